@@ -0,0 +1,335 @@
+"""Инкрементальный разбор заголовков HTTP/1.x для веб-сервера и клиента из lab03.
+
+HttpBuffer принимает данные прямо из сокета через recv_into в заранее выделенный
+bytearray, ищет конец заголовка только в новых байтах и не даёт заголовку
+вырасти больше max_header_size. Стартовая строка и заголовки разбираются лениво —
+при первом обращении к соответствующему свойству. read_head и read_body читают
+ответ из блокирующего сокета: тело по Content-Length, chunked или до закрытия.
+"""
+
+DEFAULT_CAPACITY = 4096
+MAX_HEADER_SIZE = 16 * 1024
+HEADER_END = b"\r\n\r\n"
+
+
+class HttpParseError(Exception):
+    """Заголовок сообщения слишком велик или не разбирается."""
+
+
+class MessageHead:
+    """Блок заголовка одного сообщения (без завершающей пустой строки)."""
+    __slots__ = ("raw", "_start_line", "_headers")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._start_line = None
+        self._headers = None
+
+    @property
+    def start_line(self):
+        """Стартовая строка, разбитая по пробелам не более чем на три части."""
+        if self._start_line is None:
+            end = self.raw.find(b"\r\n")
+            line = self.raw if end < 0 else self.raw[:end]
+            self._start_line = line.split(b" ", 2)
+        return self._start_line
+
+    @property
+    def headers(self):
+        """Словарь заголовков: имена в нижнем регистре, при повторе побеждает последнее значение."""
+        if self._headers is None:
+            headers = {}
+            lines = self.raw.split(b"\r\n")
+            for line in lines[1:]:
+                name, sep, value = line.partition(b":")
+                if sep:
+                    headers[name.strip().lower().decode("latin-1")] = value.strip().decode("latin-1")
+            self._headers = headers
+        return self._headers
+
+    def get(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def __bytes__(self):
+        return self.raw + HEADER_END
+
+
+class RequestHead(MessageHead):
+    """Заголовок запроса: метод, цель запроса и версия; без версии считается HTTP/1.0."""
+    __slots__ = ()
+
+    @property
+    def method(self):
+        parts = self.start_line
+        if len(parts) < 2:
+            raise HttpParseError(f"Malformed request line: {bytes(parts[0])!r}")
+        return parts[0].decode("latin-1")
+
+    @property
+    def target(self):
+        parts = self.start_line
+        if len(parts) < 2:
+            raise HttpParseError(f"Malformed request line: {bytes(parts[0])!r}")
+        try:
+            return parts[1].decode("utf-8")
+        except UnicodeDecodeError:
+            raise HttpParseError("Request target is not UTF-8")
+
+    @property
+    def version(self):
+        parts = self.start_line
+        return parts[2].decode("latin-1") if len(parts) > 2 else "HTTP/1.0"
+
+
+class ResponseHead(MessageHead):
+    """Заголовок ответа: версия, код статуса и поясняющая фраза."""
+    __slots__ = ()
+
+    @property
+    def version(self):
+        return self.start_line[0].decode("latin-1")
+
+    @property
+    def status(self):
+        parts = self.start_line
+        try:
+            return int(parts[1])
+        except (IndexError, ValueError):
+            raise HttpParseError(f"Malformed status line: {b' '.join(parts)!r}")
+
+    @property
+    def reason(self):
+        parts = self.start_line
+        return parts[2].decode("latin-1") if len(parts) > 2 else ""
+
+
+class HttpBuffer:
+    """Входной буфер соединения, из которого по очереди извлекаются заголовки сообщений.
+
+    Данные читаются через fill(sock) прямо в свободный хвост буфера; разобранные
+    байты не сдвигаются, пока не понадобится место. Буфер растёт вдвое, только
+    если в него не помещается недочитанный заголовок, и не больше max_header_size.
+    Тело сообщения вызывающий код забирает через take() или пропускает через
+    discard(): пропуск продолжается по мере прихода данных.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, max_header_size=MAX_HEADER_SIZE):
+        self.max_header_size = max_header_size
+        self._data = bytearray(capacity)
+        self._view = memoryview(self._data)
+        self._start = 0
+        self._end = 0
+        # До этой позиции конец заголовка уже искали и не нашли
+        self._scanned = 0
+        self._skip = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def view(self):
+        """memoryview непрочитанных байт; действителен до следующего fill() или feed()."""
+        return self._view[self._start:self._end]
+
+    def fill(self, sock, max_bytes=0):
+        """Читает из сокета в свободное место буфера; возвращает число байт (0 — конец потока)."""
+        self._reserve()
+        free = self._view[self._end:]
+        if max_bytes:
+            free = free[:max_bytes]
+        received = sock.recv_into(free)
+        self._end += received
+        self._apply_skip()
+        return received
+
+    def feed(self, data):
+        """Добавляет байты, полученные не из сокета (например, в тестах)."""
+        data = memoryview(data)
+        while data:
+            self._reserve()
+            n = min(len(data), len(self._data) - self._end)
+            self._view[self._end:self._end + n] = data[:n]
+            self._end += n
+            data = data[n:]
+            self._apply_skip()
+
+    def next_head(self, head_class=RequestHead):
+        """Извлекает следующий полностью принятый заголовок или возвращает None.
+
+        HttpParseError — если заголовок длиннее max_header_size.
+        """
+        if self._skip:
+            return None
+        search_from = max(self._start, self._scanned - len(HEADER_END) + 1)
+        header_end = self._data.find(HEADER_END, search_from, self._end)
+        if header_end < 0:
+            if self._end - self._start > self.max_header_size:
+                raise HttpParseError("Header too large")
+            self._scanned = self._end
+            return None
+        if header_end - self._start > self.max_header_size:
+            raise HttpParseError("Header too large")
+        raw = bytes(self._view[self._start:header_end])
+        self._consume(header_end + len(HEADER_END) - self._start)
+        return head_class(raw)
+
+    def next_line(self):
+        """Извлекает строку до CRLF (без него) или возвращает None, если она ещё не дочитана."""
+        line_end = self._data.find(b"\r\n", self._start, self._end)
+        if line_end < 0:
+            if self._end - self._start > self.max_header_size:
+                raise HttpParseError("Line too long")
+            return None
+        line = bytes(self._view[self._start:line_end])
+        self._consume(line_end + 2 - self._start)
+        return line
+
+    def pull(self, n):
+        """Забирает до n принятых байт без копирования; memoryview действителен до следующего fill()."""
+        n = min(n, len(self))
+        piece = self._view[self._start:self._start + n]
+        self._consume(n)
+        return piece
+
+    def take(self, n):
+        """Забирает до n уже принятых байт тела."""
+        n = min(n, len(self))
+        data = bytes(self._view[self._start:self._start + n])
+        self._consume(n)
+        return data
+
+    def discard(self, n):
+        """Пропускает n байт тела: сразу — принятые, остальные — по мере поступления."""
+        self._skip += n
+        self._apply_skip()
+
+    @property
+    def skipping(self):
+        """Сколько байт тела ещё предстоит пропустить."""
+        return self._skip
+
+    def _apply_skip(self):
+        if self._skip:
+            n = min(self._skip, len(self))
+            self._skip -= n
+            self._consume(n)
+
+    def _consume(self, n):
+        self._start += n
+        if self._start == self._end:
+            self._start = self._end = 0
+        self._scanned = max(self._scanned, self._start)
+        if self._start == 0:
+            self._scanned = min(self._scanned, self._end)
+
+    def _reserve(self):
+        if self._end < len(self._data):
+            return
+        if self._start:
+            # Сдвигаем недочитанный остаток в начало — это случается редко
+            unread = self._end - self._start
+            self._data[:unread] = self._data[self._start:self._end]
+            self._scanned -= self._start
+            self._start, self._end = 0, unread
+            return
+        if len(self._data) > self.max_header_size:
+            raise HttpParseError("Header too large")
+        grown = bytearray(min(len(self._data) * 2, self.max_header_size + len(HEADER_END)))
+        grown[:self._end] = self._view[:self._end]
+        self._data = grown
+        self._view = memoryview(grown)
+
+
+def read_head(sock, buf, head_class=ResponseHead):
+    """Дочитывает из блокирующего сокета следующий заголовок; ConnectionError — если поток кончился."""
+    head = buf.next_head(head_class)
+    while head is None:
+        if not buf.fill(sock):
+            raise ConnectionError("Connection closed before message headers")
+        head = buf.next_head(head_class)
+    return head
+
+
+def body_framing(head, method="GET"):
+    """Как определяется конец тела ответа: "none", "chunked", "length" или "close"."""
+    status = head.status
+    if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+        return "none"
+    if "chunked" in head.get("transfer-encoding", "").lower():
+        return "chunked"
+    if "content-length" in head.headers:
+        return "length"
+    return "close"
+
+
+def response_reusable(head, method="GET"):
+    """Можно ли после этого ответа отправить в соединение следующий запрос."""
+    connection = head.get("connection", "").lower()
+    if "close" in connection:
+        return False
+    if head.version == "HTTP/1.0" and "keep-alive" not in connection:
+        return False
+    return body_framing(head, method) != "close"
+
+
+def read_body(sock, buf, head, write, method="GET"):
+    """Читает тело ответа head и передаёт его куски в write; возвращает длину тела.
+
+    Куски — memoryview внутрь buf, их нужно использовать до возврата из write.
+    Chunked-тело декодируется, трейлеры пропускаются.
+    """
+    framing = body_framing(head, method)
+    if framing == "none":
+        return 0
+    if framing == "chunked":
+        total = 0
+        while True:
+            size_line = _read_line(sock, buf).split(b";", 1)[0].strip()
+            try:
+                size = int(size_line, 16)
+            except ValueError:
+                raise HttpParseError(f"Invalid chunk size: {size_line!r}")
+            if size < 0:
+                raise HttpParseError(f"Invalid chunk size: {size_line!r}")
+            if size == 0:
+                break
+            _read_exactly(sock, buf, size, write)
+            if _read_line(sock, buf):
+                raise HttpParseError("Missing CRLF after chunk data")
+            total += size
+        while _read_line(sock, buf):
+            pass
+        return total
+    if framing == "length":
+        try:
+            length = int(head.get("content-length"))
+        except ValueError:
+            raise HttpParseError("Invalid Content-Length")
+        if length < 0:
+            raise HttpParseError("Invalid Content-Length")
+        _read_exactly(sock, buf, length, write)
+        return length
+
+    total = 0
+    while buf or buf.fill(sock):
+        piece = buf.pull(len(buf))
+        write(piece)
+        total += len(piece)
+    return total
+
+
+def _read_line(sock, buf):
+    line = buf.next_line()
+    while line is None:
+        if not buf.fill(sock):
+            raise ConnectionError("Connection closed in the middle of a chunked body")
+        line = buf.next_line()
+    return line
+
+
+def _read_exactly(sock, buf, n, write):
+    while n:
+        if not buf and not buf.fill(sock, n):
+            raise ConnectionError("Connection closed in the middle of the message body")
+        piece = buf.pull(n)
+        write(piece)
+        n -= len(piece)
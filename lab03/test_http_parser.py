@@ -0,0 +1,98 @@
+import socket
+
+from http_parser import HttpBuffer, HttpParseError, RequestHead, ResponseHead, read_body, read_head, response_reusable
+
+print("Running tests...")
+
+passed = 0
+
+# 1. Запрос целиком в одном куске
+buf = HttpBuffer()
+buf.feed(b"GET /index.html HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n\r\n")
+head = buf.next_head(RequestHead)
+print(f"Test 1 - Request line: {head.method} {head.target} {head.version}")
+assert (head.method, head.target, head.version) == ("GET", "/index.html", "HTTP/1.1")
+assert head.headers == {"host": "localhost", "accept-encoding": "gzip"}
+assert len(buf) == 0 and buf.next_head(RequestHead) is None
+passed += 1
+
+# 2. Запрос приходит по одному байту, терминатор разрезан между кусками
+raw = b"GET /a HTTP/1.0\r\nX-Long: " + b"x" * 5000 + b"\r\n\r\n"
+buf = HttpBuffer(capacity=64)
+heads = []
+for i in range(len(raw)):
+    buf.feed(raw[i:i + 1])
+    head = buf.next_head(RequestHead)
+    if head is not None:
+        heads.append(head)
+print(f"Test 2 - Byte-by-byte: {len(heads)} head(s)")
+assert len(heads) == 1 and heads[0].get("x-long") == "x" * 5000
+passed += 1
+
+# 3. Конвейер из двух запросов; тело первого пропускается, даже если приходит позже
+buf = HttpBuffer(capacity=32)
+buf.feed(b"POST /form HTTP/1.1\r\nContent-Length: 10\r\n\r\n0123")
+first = buf.next_head(RequestHead)
+buf.discard(int(first.get("content-length")))
+assert buf.next_head(RequestHead) is None and buf.skipping == 6
+buf.feed(b"456789GET /next HTTP/1.1\r\n\r\n")
+second = buf.next_head(RequestHead)
+print(f"Test 3 - Pipelined: {first.method} {first.target}, then {second.method} {second.target}")
+assert second.target == "/next" and buf.skipping == 0
+passed += 1
+
+# 4. Слишком большой заголовок
+buf = HttpBuffer(capacity=64, max_header_size=256)
+try:
+    buf.feed(b"GET / HTTP/1.1\r\n" + b"X: y\r\n" * 100)
+    buf.next_head(RequestHead)
+    raise AssertionError("oversized header accepted")
+except HttpParseError as e:
+    print(f"Test 4 - Oversized header rejected: {e}")
+passed += 1
+
+# 5. Разбор ответа и забор тела
+buf = HttpBuffer()
+buf.feed(b"HTTP/1.1 404 Not Found\r\nContent-Length: 5\r\n\r\nhello")
+head = buf.next_head(ResponseHead)
+print(f"Test 5 - Response: {head.status} {head.reason}")
+assert head.status == 404 and head.reason == "Not Found" and buf.take(5) == b"hello"
+passed += 1
+
+# 6. Кривая стартовая строка обнаруживается при обращении к полям
+buf = HttpBuffer()
+buf.feed(b"GARBAGE\r\n\r\n")
+head = buf.next_head(RequestHead)
+try:
+    head.method
+    raise AssertionError("malformed request line accepted")
+except HttpParseError as e:
+    print(f"Test 6 - Malformed request line: {e}")
+passed += 1
+
+# 7. Chunked-тело с расширением и трейлером, за ним следующий ответ в том же соединении
+server, client = socket.socketpair()
+server.sendall(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+               b"5;ext=1\r\nhello\r\n7\r\n, world\r\n0\r\nX-Trailer: yes\r\n\r\n"
+               b"HTTP/1.1 204 No Content\r\n\r\n")
+buf = HttpBuffer(capacity=16)
+head = read_head(client, buf)
+pieces = []
+length = read_body(client, buf, head, lambda piece: pieces.append(bytes(piece)))
+print(f"Test 7 - Chunked body: {b''.join(pieces)!r}")
+assert length == 12 and b"".join(pieces) == b"hello, world" and response_reusable(head)
+assert read_head(client, buf).status == 204
+passed += 1
+
+# 8. Тело без длины читается до закрытия соединения, и соединение нельзя переиспользовать
+server.sendall(b"HTTP/1.0 200 OK\r\n\r\nuntil close")
+server.close()
+head = read_head(client, buf)
+pieces = []
+read_body(client, buf, head, lambda piece: pieces.append(bytes(piece)))
+print(f"Test 8 - Close-delimited body: {b''.join(pieces)!r}")
+assert b"".join(pieces) == b"until close" and not response_reusable(head)
+client.close()
+passed += 1
+
+print(f"\nAll tests passed: {passed}")
@@ -1,73 +1,80 @@
+import argparse
+import math
+import os
+import queue
 import socket
 import sys
+import threading
+import time
+
+# Разборщик HTTP общий для сервера и клиента и лежит уровнем выше, в lab03/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_parser import HttpBuffer, HttpParseError, read_body, read_head, response_reusable
 
 BUFFER_SIZE = 4096
+LOAD_BUFFER_SIZE = 64 * 1024
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_DIR = "downloads"
 
-def main():
-    if len(sys.argv) != 4:
-        print(f"Usage: python {sys.argv[0]} <server_host> <server_port> <filename>")
-        sys.exit(1)
 
-    server_host = sys.argv[1]
-    
-    try:
-        server_port = int(sys.argv[2])
-        if not (0 <= server_port <= 65535):
-            raise ValueError("Port number must be between 0 and 65535")
-    except ValueError as e:
-        print(f"Error: Invalid port number '{sys.argv[2]}'. {e}")
-        sys.exit(1)
-        
-    filename = sys.argv[3]
-    if not filename.startswith('/'):
-        request_path = "/" + filename
-    else:
-        request_path = filename
-
-    client_socket = None 
+def build_request(server_host, server_port, request_path, keep_alive):
+    request_lines = [
+        f"GET {request_path} HTTP/1.1",
+        f"Host: {server_host}:{server_port}",
+        "Connection: keep-alive" if keep_alive else "Connection: close",
+        "Accept: */*"
+    ]
+    return ("\r\n".join(request_lines) + "\r\n\r\n").encode('utf-8')
+
+
+def discard(piece):
+    pass
+
+
+def fetch_once(server_host, server_port, request_path):
+    """Одиночный GET: печатает запрос и ответ сервера целиком."""
+    client_socket = None
     try:
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         print(f"Connecting to {server_host}:{server_port}...")
-        
+
         client_socket.connect((server_host, server_port))
         print("Connected to server.")
 
-        request_lines = [
-            f"GET {request_path} HTTP/1.1",
-            f"Host: {server_host}:{server_port}",
-            "Connection: close",
-            "Accept: */*"
-        ]
-        http_request = "\r\n".join(request_lines) + "\r\n\r\n"
+        http_request = build_request(server_host, server_port, request_path, keep_alive=False)
 
         print("--- Sending Request ---")
-        print(http_request.rstrip('\r\n')) 
+        print(http_request.decode('utf-8').rstrip('\r\n'))
         print("-----------------------")
-        
-        client_socket.sendall(http_request.encode('utf-8'))
+
+        client_socket.sendall(http_request)
 
         print("\n--- Server Response ---")
-        full_response = b""
-        while True:
-            data = client_socket.recv(BUFFER_SIZE)
-            if not data:
-                break
-            full_response += data
-        
+        buf = HttpBuffer(BUFFER_SIZE)
+        head = read_head(client_socket, buf)
+        print(head.raw.decode('latin-1'))
+        print()
+
+        chunks = []
+        read_body(client_socket, buf, head, lambda piece: chunks.append(bytes(piece)))
+        body = b"".join(chunks)
+
         try:
-            print(full_response.decode('utf-8'))
+            print(body.decode('utf-8'))
         except UnicodeDecodeError:
             print("Received binary data (or non-UTF-8 encoded text).")
-            print(f"Received {len(full_response)} bytes.")
+            print(f"Received {len(body)} bytes.")
 
         print("-----------------------")
 
     except socket.gaierror as e:
         print(f"Error: Could not resolve host '{server_host}'. {e}")
-    except socket.error as e:
-        print(f"Socket error: {e}")
     except ConnectionRefusedError:
         print(f"Error: Connection to {server_host}:{server_port} refused. Is the server running?")
+    except socket.error as e:
+        print(f"Socket error: {e}")
+    except HttpParseError as e:
+        print(f"Malformed response: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
     finally:
@@ -75,5 +82,344 @@ def main():
             print("Closing socket.")
             client_socket.close()
 
+
+class LoadStats:
+    """Результаты нагрузочного прогона, которые рабочие потоки копят под одной блокировкой."""
+
+    def __init__(self):
+        self.latencies = []
+        self.bytes_received = 0
+        self.errors = 0
+        self.status_codes = {}
+        self._lock = threading.Lock()
+
+    def record(self, latency, status_code, received):
+        with self._lock:
+            self.latencies.append(latency)
+            self.bytes_received += received
+            self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+
+class RequestSchedule:
+    """Раздаёт рабочим потокам номера запросов и, если задан rate, моменты их отправки."""
+
+    def __init__(self, total_requests, duration, rate):
+        self.total_requests = total_requests
+        self.rate = rate
+        self.started = time.monotonic()
+        self.deadline = self.started + duration if duration else None
+        self._issued = 0
+        self._lock = threading.Lock()
+
+    def next_slot(self):
+        """Возвращает (номер_запроса, запланированное_время_отправки) или None, если хватит."""
+        with self._lock:
+            if self.total_requests is not None and self._issued >= self.total_requests:
+                return None
+            index = self._issued
+            self._issued += 1
+        if self.rate:
+            scheduled = self.started + index / self.rate
+        else:
+            scheduled = time.monotonic()
+        if self.deadline is not None and scheduled >= self.deadline:
+            return None
+        return index, scheduled
+
+
+def read_response(sock, buf):
+    """Читает один ответ и отбрасывает тело, не копируя его из буфера соединения.
+
+    buf — HttpBuffer соединения: в нём остаётся всё, что пришло после ответа.
+    Возвращает (код_статуса, число_байт_ответа, можно_ли_переиспользовать_соединение).
+    """
+    head = read_head(sock, buf)
+    body_length = read_body(sock, buf, head, discard)
+    return head.status, len(head.raw) + 4 + body_length, response_reusable(head)
+
+
+def load_worker(server_host, server_port, requests, keep_alive, schedule, stats):
+    sock = None
+    buf = HttpBuffer(LOAD_BUFFER_SIZE)
+    while True:
+        slot = schedule.next_slot()
+        if slot is None:
+            break
+        index, scheduled = slot
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        # При заданном rate задержку считаем от запланированного момента, чтобы отставание
+        # генератора от графика не пряталось из перцентилей
+        started = scheduled if schedule.rate else time.monotonic()
+        try:
+            if sock is None:
+                sock = socket.create_connection((server_host, server_port))
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                buf = HttpBuffer(LOAD_BUFFER_SIZE)
+            sock.sendall(requests[index % len(requests)])
+            status_code, received, reusable = read_response(sock, buf)
+            stats.record(time.monotonic() - started, status_code, received)
+            if not (keep_alive and reusable):
+                sock.close()
+                sock = None
+        except (OSError, ValueError, HttpParseError):
+            stats.record_error()
+            if sock is not None:
+                sock.close()
+                sock = None
+    if sock is not None:
+        sock.close()
+
+
+def percentile(sorted_values, p):
+    """Перцентиль по ближайшему рангу для уже отсортированного списка."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def run_load(server_host, server_port, request_paths, concurrency, total_requests, duration, keep_alive, rate):
+    """Нагрузочный режим: concurrency соединений шлют GET по путям по кругу и собирают задержки."""
+    requests = [build_request(server_host, server_port, path, keep_alive) for path in request_paths]
+
+    print(f"Loading {', '.join(request_paths)} from {server_host}:{server_port} with {concurrency} connections"
+          f"{' (keep-alive)' if keep_alive else ''}"
+          f"{f', target {rate} req/s' if rate else ''}...")
+    stats = LoadStats()
+    schedule = RequestSchedule(total_requests, duration, rate)
+    workers = [
+        threading.Thread(target=load_worker, args=(server_host, server_port, requests, keep_alive, schedule, stats),
+                         daemon=True)
+        for _ in range(concurrency)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - schedule.started
+
+    latencies = sorted(stats.latencies)
+    completed = len(latencies)
+    print("--- Load Test Results ---")
+    print(f"Requests: {completed} completed, {stats.errors} errors in {elapsed:.2f} s")
+    print(f"Throughput: {completed / elapsed:.1f} req/s, {stats.bytes_received / elapsed / 1024:.1f} KiB/s")
+    if latencies:
+        print(f"Latency: p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+              f"p90 {percentile(latencies, 90) * 1000:.2f} ms, "
+              f"p99 {percentile(latencies, 99) * 1000:.2f} ms, "
+              f"max {latencies[-1] * 1000:.2f} ms")
+    print(f"Status codes: {dict(sorted(stats.status_codes.items()))}")
+    print("-------------------------")
+
+
+def local_path(output_dir, request_path):
+    """Путь на диске для скачиваемого URL; каталоги и пути с ".." отвергаются."""
+    rel = request_path.split("?", 1)[0].lstrip("/")
+    if not rel or rel.endswith("/"):
+        rel += "index.html"
+    parts = [part for part in rel.split("/") if part not in ("", ".")]
+    if ".." in parts:
+        raise ValueError(f"Refusing to save {request_path} outside {output_dir}")
+    return os.path.join(output_dir, *parts)
+
+
+class DownloadConnection:
+    """Постоянное соединение рабочего потока загрузки; переоткрывается, если сервер его закрыл."""
+
+    def __init__(self, server_host, server_port):
+        self.server_host = server_host
+        self.server_port = server_port
+        self.sock = None
+        self.buf = None
+        self.opened = 0
+        self.requests = 0
+
+    def request(self, request):
+        """Отправляет запрос и возвращает заголовок ответа.
+
+        Если уже использованное соединение оказалось закрыто сервером (тайм-аут простоя
+        или лимит запросов), запрос повторяется один раз в новом соединении — GET идемпотентен.
+        """
+        reused = self.sock is not None
+        try:
+            return self._request(request)
+        except (ConnectionError, OSError):
+            self.close()
+            if not reused:
+                raise
+        return self._request(request)
+
+    def _request(self, request):
+        if self.sock is None:
+            self.sock = socket.create_connection((self.server_host, self.server_port))
+            self.buf = HttpBuffer(LOAD_BUFFER_SIZE)
+            self.opened += 1
+        self.sock.sendall(request)
+        head = read_head(self.sock, self.buf)
+        self.requests += 1
+        return head
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def download_worker(server_host, server_port, jobs, output_dir, report):
+    conn = DownloadConnection(server_host, server_port)
+    try:
+        while True:
+            try:
+                request_path = jobs.get_nowait()
+            except queue.Empty:
+                break
+            started = time.monotonic()
+            try:
+                target = local_path(output_dir, request_path)
+                head = conn.request(build_request(server_host, server_port, request_path, keep_alive=True))
+                if head.status == 200:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    # Тело пишется во временный файл по мере поступления и подменяет старый только целиком
+                    partial = target + ".part"
+                    try:
+                        with open(partial, "wb") as out:
+                            size = read_body(conn.sock, conn.buf, head, out.write)
+                        os.replace(partial, target)
+                    except BaseException:
+                        if os.path.exists(partial):
+                            os.remove(partial)
+                        raise
+                else:
+                    size = read_body(conn.sock, conn.buf, head, discard)
+                    target = None
+                if not response_reusable(head):
+                    conn.close()
+                report(request_path, head.status, size, time.monotonic() - started, target, None)
+            except (OSError, ValueError, HttpParseError) as e:
+                conn.close()
+                report(request_path, None, 0, time.monotonic() - started, None, e)
+    finally:
+        conn.close()
+        report.connections(conn.opened, conn.requests)
+
+
+class DownloadReport:
+    """Печатает результат каждого файла по мере готовности и копит итоги загрузки."""
+
+    def __init__(self):
+        self.saved = 0
+        self.failed = 0
+        self.bytes = 0
+        self.connections_opened = 0
+        self.requests_sent = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request_path, status, size, elapsed, target, error):
+        with self._lock:
+            if error is not None:
+                self.failed += 1
+                print(f"{request_path}: failed after {elapsed * 1000:.1f} ms: {error}")
+            elif target is None:
+                self.failed += 1
+                print(f"{request_path}: HTTP {status}, not saved")
+            else:
+                self.saved += 1
+                self.bytes += size
+                print(f"{request_path}: HTTP {status}, {size} bytes in {elapsed * 1000:.1f} ms -> {target}")
+
+    def connections(self, opened, requests):
+        with self._lock:
+            self.connections_opened += opened
+            self.requests_sent += requests
+
+
+def download_files(server_host, server_port, request_paths, output_dir, connections):
+    """Скачивает пути в output_dir через пул из connections постоянных соединений."""
+    jobs = queue.Queue()
+    for request_path in request_paths:
+        jobs.put(request_path)
+    connections = min(connections, len(request_paths))
+    print(f"Downloading {len(request_paths)} file(s) from {server_host}:{server_port} "
+          f"over {connections} connection(s) into {output_dir}/")
+
+    report = DownloadReport()
+    started = time.monotonic()
+    workers = [
+        threading.Thread(target=download_worker, args=(server_host, server_port, jobs, output_dir, report),
+                         daemon=True)
+        for _ in range(connections)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    print("--- Download Results ---")
+    print(f"Files: {report.saved} saved, {report.failed} failed in {elapsed:.2f} s")
+    print(f"Received: {report.bytes} bytes, {report.bytes / elapsed / 1024:.1f} KiB/s")
+    print(f"Connections: {report.connections_opened} opened for {report.requests_sent} requests")
+    print("------------------------")
+    return report.failed == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP-клиент для веб-сервера из lab03 с загрузкой файлов "
+                                                 "и нагрузочным режимом")
+    parser.add_argument("server_host")
+    parser.add_argument("server_port", type=int)
+    parser.add_argument("filenames", nargs="+", metavar="filename")
+    parser.add_argument("-o", "--output-dir",
+                        help=f"сохранить файлы в каталог; включается и при нескольких путях (по умолчанию {DOWNLOAD_DIR})")
+    parser.add_argument("-j", "--connections", type=int, default=DOWNLOAD_CONNECTIONS,
+                        help="число постоянных соединений для загрузки файлов")
+    parser.add_argument("-c", "--concurrency", type=int,
+                        help="число одновременных соединений; включает нагрузочный режим")
+    parser.add_argument("-n", "--requests", type=int,
+                        help="сколько всего запросов отправить (нагрузочный режим)")
+    parser.add_argument("-d", "--duration", type=float,
+                        help="сколько секунд длится прогон (нагрузочный режим)")
+    parser.add_argument("-k", "--keep-alive", action="store_true",
+                        help="переиспользовать соединения между запросами")
+    parser.add_argument("-r", "--rate", type=float,
+                        help="целевая суммарная скорость, запросов в секунду")
+    args = parser.parse_args()
+
+    server_host = args.server_host
+    server_port = args.server_port
+    if not (0 <= server_port <= 65535):
+        print(f"Error: Invalid port number '{server_port}'. Port number must be between 0 and 65535")
+        sys.exit(1)
+
+    request_paths = [filename if filename.startswith('/') else "/" + filename for filename in args.filenames]
+
+    load_mode = args.concurrency is not None or args.requests is not None or args.duration is not None
+    if not load_mode:
+        if args.output_dir is None and len(request_paths) == 1:
+            fetch_once(server_host, server_port, request_paths[0])
+            return
+        if args.connections <= 0:
+            print("Error: --connections must be positive")
+            sys.exit(1)
+        ok = download_files(server_host, server_port, request_paths, args.output_dir or DOWNLOAD_DIR,
+                            args.connections)
+        sys.exit(0 if ok else 1)
+
+    concurrency = args.concurrency or 1
+    total_requests = args.requests
+    if total_requests is None and args.duration is None:
+        total_requests = concurrency * 100
+    if concurrency <= 0 or (total_requests is not None and total_requests <= 0) or (args.rate is not None and args.rate <= 0):
+        print("Error: --concurrency, --requests and --rate must be positive")
+        sys.exit(1)
+    run_load(server_host, server_port, request_paths, concurrency, total_requests, args.duration,
+             args.keep_alive, args.rate)
+
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
@@ -1,151 +1,356 @@
+import argparse
+import collections
+import os
+import queue
+import selectors
+import signal
 import socket
 import sys
-import os
 import threading
+import time
+import traceback
 
-HOST = '127.0.0.1'
-DEFAULT_PORT = 6789
-MAX_CONN = 5
-BUFFER_SIZE = 1024
-WEB_ROOT = "htdocs"
+from server_core import (HOST, MAX_CONN, KEEPALIVE_TIMEOUT, BUFFER_SIZE, HOT_CACHE, GZIP_CACHE, STATIC_INDEX,
+                         ACCESS_LOG, REQUEST_TIMINGS, STATS_PROVIDERS, FileBody, close_parts, build_response_head,
+                         error_response, finish_requests, new_request_buffer, respond_to_buffered, serve_connection)
 
-semaphore = None 
+REACTOR_BACKLOG = socket.SOMAXCONN
+POOL_QUEUE_SIZE = 64
+POOL_STATS_INTERVAL = 10.0
+WORKER_RESTART_DELAY = 1.0
+WORKER_CRASHED = 70
 
-def get_content_type(filepath):
-    """Определяет Content-Type на основе расширения файла."""
-    if filepath.endswith(".html") or filepath.endswith(".htm"):
-        return "text/html; charset=utf-8"
-    elif filepath.endswith(".txt"):
-        return "text/plain; charset=utf-8"
-    elif filepath.endswith(".jpg") or filepath.endswith(".jpeg"):
-        return "image/jpeg"
-    elif filepath.endswith(".png"):
-        return "image/png"
-    elif filepath.endswith(".css"):
-        return "text/css; charset=utf-8"
-    return "application/octet-stream"
-
-def handle_request(request_str):
-    """Обрабатывает HTTP-запрос и возвращает кортеж (статус, заголовки, тело_ответа)."""
-    try:
-        first_line = request_str.split('\r\n')[0]
-        parts = first_line.split(' ')
-        if len(parts) < 2:
-            return "400 Bad Request", {"Content-Type": "text/html; charset=utf-8", "Connection": "close"}, b"<html><body><h1>400 Bad Request</h1></body></html>"
-        
-        method = parts[0]
-        requested_path = parts[1]
-
-        if method != "GET":
-            return "501 Not Implemented", {"Content-Type": "text/html; charset=utf-8", "Connection": "close"}, b"<html><body><h1>501 Not Implemented</h1></body></html>"
-
-        if requested_path == "/":
-            requested_path = "/index.html"
-        
-        relative_filepath = requested_path.lstrip('/') 
-        filepath = os.path.join(WEB_ROOT, relative_filepath)
-
-        if not os.path.abspath(filepath).startswith(os.path.abspath(WEB_ROOT)):
-            print(f"Attempt to access file outside WEB_ROOT: {filepath}")
-            return "403 Forbidden", {"Content-Type": "text/html; charset=utf-8", "Connection": "close"}, b"<html><body><h1>403 Forbidden</h1></body></html>"
-
-        if os.path.exists(filepath) and os.path.isfile(filepath):
-            try:
-                with open(filepath, 'rb') as f:
-                    file_content = f.read()
-                
-                content_type = get_content_type(filepath)
-                headers = {
-                    "Content-Type": content_type,
-                    "Content-Length": str(len(file_content)),
-                    "Connection": "close"
-                }
-                return "200 OK", headers, file_content
-            except IOError as e:
-                print(f"Error reading file {filepath}: {e}")
-                return "500 Internal Server Error", {"Content-Type": "text/html; charset=utf-8", "Connection": "close"}, b"<html><body><h1>500 Internal Server Error</h1><p>Could not read file.</p></body></html>"
-        else:
-            print(f"File not found: {filepath}")
-            error_body = f"<html><body><h1>404 Not Found</h1><p>File requested: {requested_path}</p></body></html>".encode('utf-8')
-            headers = {
-                "Content-Type": "text/html; charset=utf-8",
-                "Content-Length": str(len(error_body)),
-                "Connection": "close"
-            }
-            return "404 Not Found", headers, error_body
+def _service_unavailable_response():
+    status, headers, body = error_response("503 Service Unavailable", "<p>Server is overloaded, try again later.</p>")
+    headers["Retry-After"] = "1"
+    return build_response_head(status, headers) + body
 
-    except Exception as e:
-        print(f"Error processing request: {e}")
-        return "500 Internal Server Error", {"Content-Type": "text/html; charset=utf-8", "Connection": "close"}, b"<html><body><h1>500 Internal Server Error</h1><p>An error occurred while processing the request.</p></body></html>"
+SERVICE_UNAVAILABLE = _service_unavailable_response()
+
+semaphore = None 
 
 def handle_client_connection(client_socket, client_address):
     """Обрабатывает соединение с одним клиентом."""
     try:
-        print(f"Thread started for {client_address}")
-        request_data = client_socket.recv(BUFFER_SIZE)
-        if not request_data:
-            print(f"Client {client_address} sent empty data or closed connection prematurely.")
-            client_socket.close()
-            return
-        
-        request_str = request_data.decode('utf-8')
-        print(f"--- Received Request from {client_address} ---")
-        print(request_str)
-        print("------------------------")
-
-        status, headers, body = handle_request(request_str)
-        
-        response_lines = [f"HTTP/1.1 {status}"]
-        for key, value in headers.items():
-            response_lines.append(f"{key}: {value}")
-        response_lines.append("\r\n")
-        
-        http_response_header = "\r\n".join(response_lines).encode('utf-8')
-        http_response = http_response_header + body
-
-        client_socket.sendall(http_response)
-        print(f"Sent HTTP response to {client_address}.")
+        serve_connection(client_socket, client_address)
 
     except socket.error as err:
         print(f"Error during communication with {client_address}: {err}")
-    except UnicodeDecodeError:
-        print(f"Error decoding request from {client_address}. Not UTF-8?")
     finally:
-        print(f"Closing connection with {client_address}.")
         client_socket.close()
-        print(f"Thread for {client_address} finished.")
         if semaphore:
             semaphore.release()
-            print(f"Semaphore released by thread for {client_address}. Current permits: {semaphore._value if hasattr(semaphore, '_value') else 'N/A'}")
+
+class ReactorConnection:
+    """Состояние одного неблокирующего соединения в режиме reactor."""
+    __slots__ = ("sock", "address", "inbuf", "parts", "sent", "served", "keep_alive", "last_active",
+                 "records", "send_started")
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.inbuf = new_request_buffer()
+        self.parts = collections.deque()
+        self.sent = 0
+        self.served = 0
+        self.keep_alive = True
+        self.last_active = time.monotonic()
+        self.records = []
+        self.send_started = 0.0
+
+def _reactor_close(sel, conn):
+    try:
+        sel.unregister(conn.sock)
+    except (KeyError, ValueError):
+        pass
+    close_parts(conn.parts)
+    conn.parts.clear()
+    conn.sock.close()
+
+def _reactor_accept(sel, server_socket):
+    # За одно пробуждение забираем из очереди listen() все готовые соединения
+    while True:
+        try:
+            client_socket, client_address = server_socket.accept()
+        except BlockingIOError:
+            return
+        except socket.error as err:
+            print(f"Accepting connection failed with error {err}")
+            return
+        client_socket.setblocking(False)
+        sel.register(client_socket, selectors.EVENT_READ, ReactorConnection(client_socket, client_address))
+
+def _reactor_respond(sel, conn):
+    # Отвечаем на всё, что уже лежит в буфере; пока ответ не ушёл, новые данные не читаем
+    parts, records, conn.keep_alive = respond_to_buffered(conn.inbuf, conn.served, conn.address)
+    conn.served += len(records)
+    if not parts:
+        return
+    conn.parts.extend(parts)
+    conn.sent = 0
+    conn.records = records
+    conn.send_started = time.perf_counter()
+    sel.modify(conn.sock, selectors.EVENT_WRITE, conn)
+    # Чаще всего ответ целиком помещается в буфер сокета — пишем сразу, не дожидаясь select()
+    _reactor_write(sel, conn)
+
+def _reactor_read(sel, conn):
+    try:
+        received = conn.inbuf.fill(conn.sock)
+    except BlockingIOError:
+        return
+    except socket.error as err:
+        print(f"Error during communication with {conn.address}: {err}")
+        _reactor_close(sel, conn)
+        return
+    if not received:
+        _reactor_close(sel, conn)
+        return
+
+    conn.last_active = time.monotonic()
+    _reactor_respond(sel, conn)
+
+def _reactor_write(sel, conn):
+    try:
+        while conn.parts:
+            part = conn.parts[0]
+            if isinstance(part, FileBody):
+                part.send_some(conn.sock)
+                if part.count:
+                    continue
+                part.close()
+            else:
+                conn.sent += conn.sock.send(memoryview(part)[conn.sent:])
+                if conn.sent < len(part):
+                    continue
+                conn.sent = 0
+            conn.parts.popleft()
+    except BlockingIOError:
+        conn.last_active = time.monotonic()
+        return
+    except OSError as err:
+        print(f"Error during communication with {conn.address}: {err}")
+        _reactor_close(sel, conn)
+        return
+    conn.last_active = time.monotonic()
+    finish_requests(conn.records, time.perf_counter() - conn.send_started)
+    conn.records = []
+    if not conn.keep_alive:
+        _reactor_close(sel, conn)
+        return
+    sel.modify(conn.sock, selectors.EVENT_READ, conn)
+    if conn.inbuf:
+        _reactor_respond(sel, conn)
+
+def _reactor_sweep_idle(sel, now):
+    for key in list(sel.get_map().values()):
+        conn = key.data
+        if conn is not None and now - conn.last_active > KEEPALIVE_TIMEOUT:
+            _reactor_close(sel, conn)
+
+def run_reactor(server_socket):
+    """Обслуживает все соединения в одном потоке через selectors (epoll на Linux)."""
+    sel = selectors.DefaultSelector()
+    server_socket.setblocking(False)
+    sel.register(server_socket, selectors.EVENT_READ, None)
+    print(f"Reactor started with {type(sel).__name__}")
+    next_sweep = time.monotonic() + 1
+    try:
+        while True:
+            for key, mask in sel.select(timeout=1):
+                if key.data is None:
+                    _reactor_accept(sel, key.fileobj)
+                elif mask & selectors.EVENT_READ:
+                    _reactor_read(sel, key.data)
+                elif mask & selectors.EVENT_WRITE:
+                    _reactor_write(sel, key.data)
+            now = time.monotonic()
+            if now >= next_sweep:
+                _reactor_sweep_idle(sel, now)
+                next_sweep = now + 1
+    finally:
+        for key in list(sel.get_map().values()):
+            if key.data is not None:
+                key.fileobj.close()
+        sel.close()
+
+class WorkerPool:
+    """Фиксированный пул потоков, получающий соединения через ограниченную очередь.
+
+    Когда очередь заполнена, acceptor сразу отвечает 503 вместо того, чтобы перестать
+    вызывать accept() и дать переполниться очереди listen() в ядре.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.accepted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"worker-{i}", daemon=True).start()
+
+    def submit(self, client_socket, client_address):
+        """Ставит соединение в очередь; False — очередь полна."""
+        try:
+            self.queue.put_nowait((client_socket, client_address, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        return True
+
+    def has_waiting(self):
+        return not self.queue.empty()
+
+    def _worker(self):
+        while True:
+            client_socket, client_address, enqueued = self.queue.get()
+            waited = time.monotonic() - enqueued
+            with self._lock:
+                self.accepted += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+            try:
+                serve_connection(client_socket, client_address, yield_idle=self.has_waiting)
+            except socket.error as err:
+                print(f"Error during communication with {client_address}: {err}")
+            finally:
+                client_socket.close()
+
+    def stats(self):
+        with self._lock:
+            avg_wait = self.total_wait / self.accepted if self.accepted else 0.0
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(avg_wait * 1000, 2),
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+            }
+
+def reject_overloaded(client_socket):
+    """Отвечает 503, не блокируя поток accept() на медленном клиенте."""
+    try:
+        client_socket.setblocking(False)
+        client_socket.send(SERVICE_UNAVAILABLE)
+        # Непрочитанный запрос при close() превратился бы в RST, и клиент не увидел бы ответ
+        client_socket.shutdown(socket.SHUT_WR)
+        client_socket.recv(BUFFER_SIZE)
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
+
+def report_pool_stats(pool, interval):
+    while True:
+        time.sleep(interval)
+        print(f"Pool stats: {pool.stats()}")
+
+def run_pool(server_socket, pool):
+    """Acceptor: принимает соединения без ожидания и раздаёт их пулу."""
+    while True:
+        try:
+            client_socket, client_address = server_socket.accept()
+        except socket.error as err:
+            print(f"Accepting connection failed with error {err}")
+            continue
+        if not pool.submit(client_socket, client_address):
+            reject_overloaded(client_socket)
+
+def run_threaded(server_socket):
+    """Поток на соединение; accept() блокируется, пока заняты все разрешения семафора."""
+    while True:
+        try:
+            semaphore.acquire()
+            client_socket, client_address = server_socket.accept()
+            client_thread = threading.Thread(target=handle_client_connection, args=(client_socket, client_address))
+            client_thread.start()
+            
+        except socket.error as err:
+            print(f"Accepting connection failed with error {err}")
+            continue
 
 def main():
-    global semaphore
+    parser = argparse.ArgumentParser(description="Веб-сервер с ограничением числа потоков или в режиме reactor")
+    parser.add_argument("port", type=int)
+    parser.add_argument("concurrency_level", type=int, nargs="?",
+                        help="число рабочих потоков (pool) или одновременных соединений (thread)")
+    parser.add_argument("--mode", choices=("pool", "thread", "reactor"), default="pool",
+                        help="pool: фиксированный пул потоков с очередью и ответом 503 при перегрузке; "
+                             "thread: поток на соединение под семафором; reactor: один поток на selectors/epoll")
+    parser.add_argument("--queue-size", type=int, default=POOL_QUEUE_SIZE,
+                        help="длина очереди соединений, ждущих свободного потока (pool)")
+    parser.add_argument("--backlog", type=int,
+                        help=f"длина очереди listen(); по умолчанию {MAX_CONN} для thread и SOMAXCONN для остальных")
+    parser.add_argument("--stats-interval", type=float, default=POOL_STATS_INTERVAL,
+                        help="как часто печатать глубину очереди и время ожидания, секунд (0 — не печатать)")
+    parser.add_argument("--hot-cache-bytes", type=int, default=HOT_CACHE.max_bytes,
+                        help="предельный суммарный размер кэша горячих файлов, байт (0 — выключить)")
+    parser.add_argument("--hot-cache-interval", type=float, default=HOT_CACHE.check_interval,
+                        help="как часто сверять закэшированный файл с диском, секунд")
+    parser.add_argument("--index-interval", type=float, default=STATIC_INDEX.rescan_interval,
+                        help="как часто пересканировать WEB_ROOT, секунд (0 — только при запуске)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="число процессов, слушающих один порт через SO_REUSEPORT (по умолчанию 1)")
+    parser.add_argument("--access-log", default=ACCESS_LOG.path,
+                        help="файл журнала доступа в формате JSON Lines (пустая строка — не вести)")
+    parser.add_argument("--log-sample", type=float, default=ACCESS_LOG.sample_rate,
+                        help="доля запросов, попадающих в журнал доступа, от 0 до 1 (ответы 5xx пишутся всегда)")
+    args = parser.parse_args()
 
-    if len(sys.argv) != 3:
-        print(f"Usage: python {sys.argv[0]} <port> <concurrency_level>")
-        print(f"Example: python {sys.argv[0]} 6789 3")
+    if args.workers < 1:
+        print(f"Error: Invalid number of workers '{args.workers}'. Must be a positive integer")
         sys.exit(1)
-    
-    try:
-        port = int(sys.argv[1])
-        if not (1024 <= port <= 65535):
-            raise ValueError("Port number must be between 1024 and 65535")
-    except ValueError as e:
-        print(f"Error: Invalid port number '{sys.argv[1]}'. {e}")
+
+    HOT_CACHE.max_bytes = args.hot_cache_bytes
+    HOT_CACHE.check_interval = args.hot_cache_interval
+    STATIC_INDEX.rescan_interval = args.index_interval
+    if not (0 <= args.log_sample <= 1):
+        print(f"Error: Invalid sample rate '{args.log_sample}'. Must be between 0 and 1")
         sys.exit(1)
+    ACCESS_LOG.path = args.access_log
+    ACCESS_LOG.sample_rate = args.log_sample
 
-    try:
-        concurrency_level = int(sys.argv[2])
-        if concurrency_level <= 0:
-            raise ValueError("Concurrency level must be a positive integer")
-    except ValueError as e:
-        print(f"Error: Invalid concurrency level '{sys.argv[2]}'. {e}")
+    port = args.port
+    if not (1024 <= port <= 65535):
+        print(f"Error: Invalid port number '{port}'. Port number must be between 1024 and 65535")
         sys.exit(1)
 
-    semaphore = threading.Semaphore(concurrency_level)
-    print(f"Server configured with concurrency level: {concurrency_level}")
+    if args.mode in ("thread", "pool"):
+        concurrency_level = args.concurrency_level
+        if concurrency_level is None:
+            print(f"Usage: python {sys.argv[0]} <port> <concurrency_level>")
+            print(f"Example: python {sys.argv[0]} 6789 3")
+            sys.exit(1)
+        if concurrency_level <= 0:
+            print(f"Error: Invalid concurrency level '{concurrency_level}'. Concurrency level must be a positive integer")
+            sys.exit(1)
 
+        print(f"Server configured with concurrency level: {concurrency_level}")
+    else:
+        print("Server configured in reactor mode")
 
+    # Пулу и реактору с тысячами клиентов очереди из MAX_CONN соединений не хватит
+    backlog = args.backlog
+    if backlog is None:
+        backlog = MAX_CONN if args.mode == "thread" else REACTOR_BACKLOG
+
+    if args.workers > 1:
+        if not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork"):
+            print("Error: --workers requires fork() and SO_REUSEPORT, which this platform lacks")
+            sys.exit(1)
+        run_prefork(args, port, backlog)
+    else:
+        server_socket = open_server_socket(port, backlog)
+        serve(server_socket, args)
+
+def open_server_socket(port, backlog, reuse_port=False):
+    """Создаёт слушающий сокет; с reuse_port ядро делит входящие соединения между процессами."""
     try:
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         print("Socket created successfully")
@@ -154,6 +359,8 @@ def main():
         sys.exit(1)
 
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
     try:
         server_socket.bind((HOST, port))
@@ -164,36 +371,103 @@ def main():
         sys.exit(1)
 
     try:
-        server_socket.listen(MAX_CONN)
+        server_socket.listen(backlog)
         print(f"Server is listening on {HOST}:{port}...")
     except socket.error as err:
         print(f"Server listen failed with error {err}")
         server_socket.close()
         sys.exit(1)
+    return server_socket
+
+def serve(server_socket, args):
+    """Запускает цикл обслуживания выбранного режима до Ctrl+C."""
+    global semaphore
 
+    # Индекс строится в каждом процессе: поток пересканирования не переживает fork()
+    STATIC_INDEX.start()
+    ACCESS_LOG.start()
+    pool = None
     try:
-        while True:
-            print('\nWaiting for a new connection...')
-            try:
-                print(f"Waiting to acquire semaphore... Current permits: {semaphore._value if hasattr(semaphore, '_value') else 'N/A'}")
-                semaphore.acquire()
-                print(f"Semaphore acquired. Current permits: {semaphore._value if hasattr(semaphore, '_value') else 'N/A'}")
-                
-                client_socket, client_address = server_socket.accept()
-                print(f"Accepted connection from: {client_address}")
-                
-                client_thread = threading.Thread(target=handle_client_connection, args=(client_socket, client_address))
-                client_thread.start()
-                
-            except socket.error as err:
-                print(f"Accepting connection failed with error {err}")
-                continue
+        if args.mode == "reactor":
+            run_reactor(server_socket)
+        elif args.mode == "pool":
+            pool = WorkerPool(args.concurrency_level, args.queue_size)
+            STATS_PROVIDERS["pool"] = pool.stats
+            print(f"Worker pool started: {args.concurrency_level} workers, queue of {args.queue_size}")
+            if args.stats_interval > 0:
+                threading.Thread(target=report_pool_stats, args=(pool, args.stats_interval), daemon=True).start()
+            run_pool(server_socket, pool)
+        else:
+            semaphore = threading.Semaphore(args.concurrency_level)
+            run_threaded(server_socket)
 
     except KeyboardInterrupt:
         print("\nServer is shutting down.")
     finally:
         print("Closing server socket.")
         server_socket.close()
+        print(f"Hot cache stats: {HOT_CACHE.stats()}")
+        print(f"Gzip cache stats: {GZIP_CACHE.stats()}")
+        if pool is not None:
+            print(f"Pool stats: {pool.stats()}")
+        print(f"Request timings: {REQUEST_TIMINGS.stats()}")
+        ACCESS_LOG.close()
+
+def spawn_worker(args, port, backlog):
+    """Форкает процесс, который открывает свой сокет с SO_REUSEPORT и обслуживает клиентов."""
+    pid = os.fork()
+    if pid:
+        return pid
+
+    exit_code = 0
+    try:
+        # SIGTERM от родителя завершает процесс через finally, чтобы напечатать статистику
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        server_socket = open_server_socket(port, backlog, reuse_port=True)
+        serve(server_socket, args)
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = WORKER_CRASHED
+    finally:
+        sys.stdout.flush()
+        os._exit(exit_code)
+
+def run_prefork(args, port, backlog):
+    """Родитель: держит args.workers процессов-обработчиков и перезапускает упавшие."""
+    workers = {}
+    for _ in range(args.workers):
+        workers[spawn_worker(args, port, backlog)] = time.monotonic()
+    print(f"Started {args.workers} worker processes: {sorted(workers)}")
+
+    try:
+        while workers:
+            pid, status = os.wait()
+            started = workers.pop(pid, None)
+            if started is None:
+                continue
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 1:
+                # Процесс не смог открыть сокет — перезапуск не поможет
+                print(f"Worker {pid} failed to start, shutting down.")
+                break
+            print(f"Worker {pid} exited with status {status}, restarting.")
+            if time.monotonic() - started < WORKER_RESTART_DELAY:
+                time.sleep(WORKER_RESTART_DELAY)
+            workers[spawn_worker(args, port, backlog)] = time.monotonic()
+    except KeyboardInterrupt:
+        print("\nServer is shutting down.")
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,1053 @@
+import collections
+import email.utils
+import gzip
+import json
+import socket
+import os
+import random
+import stat
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import unquote
+
+# Разборщик HTTP общий для сервера и клиента и лежит уровнем выше, в lab03/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_parser import HttpBuffer, HttpParseError, RequestHead
+
+HOST = '127.0.0.1'
+DEFAULT_PORT = 6789
+MAX_CONN = 5
+BUFFER_SIZE = 1024
+WEB_ROOT = "htdocs"
+
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+KEEPALIVE_TIMEOUT = 5
+KEEPALIVE_MAX_REQUESTS = 100
+IDLE_POLL_INTERVAL = 0.5
+SENDFILE_CHUNK = 1024 * 1024
+HAS_SENDFILE = hasattr(os, "sendfile")
+# Заголовок, за которым сразу идёт файл, придерживаем в ядре до первых байт тела
+MSG_MORE = getattr(socket, "MSG_MORE", 0)
+
+MAX_RANGES = 16
+
+HOT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+HOT_CACHE_MAX_FILE_SIZE = 256 * 1024
+HOT_CACHE_CHECK_INTERVAL = 2.0
+
+GZIP_MIN_SIZE = 512
+GZIP_MAX_SIZE = 4 * 1024 * 1024
+GZIP_CACHE_MAX_BYTES = 16 * 1024 * 1024
+GZIP_LEVEL = 6
+GZIP_TYPES = {
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+}
+
+INDEX_RESCAN_INTERVAL = 5.0
+
+ACCESS_LOG_PATH = "access.log"
+ACCESS_LOG_SAMPLE_RATE = 1.0
+ACCESS_LOG_FLUSH_INTERVAL = 1.0
+ACCESS_LOG_BATCH_SIZE = 256
+ACCESS_LOG_MAX_PENDING = 65536
+STATS_PATH = "/__stats"
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".htm": "text/html; charset=utf-8",
+    ".txt": "text/plain; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".json": "application/json",
+    ".xml": "application/xml",
+    ".svg": "image/svg+xml",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".ico": "image/x-icon",
+    ".webp": "image/webp",
+    ".pdf": "application/pdf",
+    ".gz": "application/gzip",
+}
+
+CONNECTION_CLOSE = b"Connection: close\r\n\r\n"
+CONNECTION_KEEP_ALIVE = f"Connection: keep-alive\r\nKeep-Alive: timeout={KEEPALIVE_TIMEOUT}\r\n\r\n".encode('utf-8')
+
+
+class BadRequest(HttpParseError):
+    """Запрос невозможно разобрать: отвечаем 400 и закрываем соединение."""
+
+
+class FileBody:
+    """Тело ответа из открытого файла: байты идут в сокет через sendfile, минуя память процесса.
+
+    Несколько FileBody могут делить один файл (multipart/byteranges); закрывает его
+    только владелец — последняя из частей.
+    """
+    __slots__ = ("file", "offset", "count", "owner")
+
+    def __init__(self, file, offset, count, owner=True):
+        self.file = file
+        self.offset = offset
+        self.count = count
+        self.owner = owner
+
+    def send_blocking(self, sock):
+        """Отправляет весь диапазон в блокирующий сокет.
+
+        socket.sendfile сам откатывается на чтение кусками, если os.sendfile недоступен.
+        """
+        if self.count == 0:
+            return
+        sent = sock.sendfile(self.file, self.offset, self.count)
+        if sent < self.count:
+            raise OSError(f"File {self.file.name} shrank while sending")
+        self.offset += sent
+        self.count = 0
+
+    def send_some(self, sock):
+        """Отправляет сколько получится в неблокирующий сокет; BlockingIOError пробрасывается."""
+        if HAS_SENDFILE:
+            sent = os.sendfile(sock.fileno(), self.file.fileno(), self.offset, min(self.count, SENDFILE_CHUNK))
+        else:
+            self.file.seek(self.offset)
+            data = self.file.read(min(self.count, SENDFILE_CHUNK))
+            sent = sock.send(data) if data else 0
+        if sent == 0:
+            raise OSError(f"File {self.file.name} shrank while sending")
+        self.offset += sent
+        self.count -= sent
+
+    def close(self):
+        if self.owner:
+            self.file.close()
+
+
+class HotFileEntry:
+    __slots__ = ("head", "content", "etag", "mtime", "not_modified_head", "filepath", "mtime_ns", "size", "checked")
+
+    def __init__(self, head, content, etag, mtime, not_modified_head, filepath, mtime_ns, size, checked):
+        self.head = head
+        self.content = content
+        self.etag = etag
+        self.mtime = mtime
+        self.not_modified_head = not_modified_head
+        self.filepath = filepath
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.checked = checked
+
+
+class HotFileCache:
+    """LRU-кэш горячих файлов WEB_ROOT с ограничением суммарного размера в байтах.
+
+    По пути запроса и классу клиента (принимает ли он gzip, см. negotiation_key) хранит
+    готовые байты статусной строки и заголовков (без Connection) для ответов 200 и 304
+    и тело — содержимое файла или его сжатый вариант. С диском (mtime и размер) запись сверяется не чаще раза
+    в check_interval секунд, так что попадание обходится без системных вызовов,
+    кроме отправки ответа.
+    """
+
+    def __init__(self, max_bytes=HOT_CACHE_MAX_BYTES, max_file_size=HOT_CACHE_MAX_FILE_SIZE,
+                 check_interval=HOT_CACHE_CHECK_INTERVAL):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Возвращает актуальную запись для пути запроса или None."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+
+        now = time.monotonic()
+        if now - entry.checked >= self.check_interval:
+            try:
+                st = os.stat(entry.filepath)
+                fresh = st.st_mtime_ns == entry.mtime_ns and st.st_size == entry.size
+            except OSError:
+                fresh = False
+            if not fresh:
+                with self._lock:
+                    if self._entries.get(path) is entry:
+                        self._remove(path)
+                    self.misses += 1
+                return None
+            entry.checked = now
+
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, path, filepath, st, head, content, etag, not_modified_head):
+        """Кладёт ответ в кэш, если он достаточно мал; st — результат fstat исходного файла."""
+        if len(content) > self.max_file_size or len(content) > self.max_bytes:
+            return
+        entry = HotFileEntry(head, content, etag, st.st_mtime, not_modified_head,
+                             filepath, st.st_mtime_ns, st.st_size, time.monotonic())
+        with self._lock:
+            if path in self._entries:
+                self._remove(path)
+            self._entries[path] = entry
+            self._size += len(content)
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, path):
+        entry = self._entries.pop(path)
+        self._size -= len(entry.content)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+HOT_CACHE = HotFileCache()
+
+
+class GzipCache:
+    """LRU сжатых на лету вариантов файлов с ограничением суммарного размера в байтах.
+
+    Ключ включает mtime и размер исходного файла, поэтому изменённый файл
+    просто перестаёт находиться, а его старый вариант вытесняется.
+    """
+
+    def __init__(self, max_bytes=GZIP_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+GZIP_CACHE = GzipCache()
+
+
+class IndexEntry:
+    __slots__ = ("url_path", "filepath", "size", "mtime_ns", "content_type")
+
+    def __init__(self, url_path, filepath, size, mtime_ns, content_type):
+        self.url_path = url_path
+        self.filepath = filepath
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.content_type = content_type
+
+
+class StaticIndex:
+    """Индекс всех отдаваемых файлов WEB_ROOT: путь URL -> IndexEntry.
+
+    Маршрутизация запроса сводится к поиску в словаре: ни проверка выхода
+    за WEB_ROOT, ни ответ 404 не трогают файловую систему. Индекс целиком
+    перестраивается раз в rescan_interval секунд и подменяется одним присваиванием,
+    так что файлы, добавленные между пересканированиями, видны не сразу.
+    """
+
+    def __init__(self, root, rescan_interval=INDEX_RESCAN_INTERVAL):
+        self.root = root
+        self.rescan_interval = rescan_interval
+        self.scans = 0
+        self._files = None
+        self._thread = None
+
+    def scan(self):
+        files = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            rel_dir = os.path.relpath(dirpath, self.root)
+            prefix = "/" if rel_dir == "." else "/" + rel_dir.replace(os.sep, "/") + "/"
+            for name in filenames:
+                filepath = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(filepath)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                url_path = prefix + name
+                files[url_path] = IndexEntry(url_path, filepath, st.st_size, st.st_mtime_ns, get_content_type(name))
+        self._files = files
+        self.scans += 1
+        return files
+
+    def lookup(self, url_path):
+        files = self._files
+        if files is None:
+            files = self.scan()
+        return files.get(url_path)
+
+    def start(self):
+        """Строит индекс и запускает фоновое пересканирование (вызывать в каждом процессе)."""
+        self.scan()
+        print(f"Indexed {len(self._files)} files under {self.root}")
+        if self.rescan_interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._rescan_loop, name="static-index", daemon=True)
+            self._thread.start()
+
+    def _rescan_loop(self):
+        while True:
+            time.sleep(self.rescan_interval)
+            try:
+                self.scan()
+            except OSError as e:
+                print(f"Rescanning {self.root} failed: {e}")
+
+    def stats(self):
+        files = self._files
+        return {"files": len(files) if files is not None else 0, "scans": self.scans}
+
+
+STATIC_INDEX = StaticIndex(WEB_ROOT)
+
+
+class AccessLog:
+    """Журнал доступа в формате JSON Lines, который пишет фоновый поток пачками.
+
+    Поток обработки только кладёт кортеж в список под блокировкой; сериализация
+    и запись в файл происходят в потоке журнала раз в flush_interval секунд или
+    при накоплении batch_size записей. В журнал попадает доля sample_rate запросов
+    (ответы 5xx — всегда); когда писатель не успевает и накоплено max_pending
+    записей, новые отбрасываются и учитываются в dropped.
+    """
+
+    def __init__(self, path=ACCESS_LOG_PATH, sample_rate=ACCESS_LOG_SAMPLE_RATE,
+                 flush_interval=ACCESS_LOG_FLUSH_INTERVAL, batch_size=ACCESS_LOG_BATCH_SIZE,
+                 max_pending=ACCESS_LOG_MAX_PENDING):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.written = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._file = None
+        self._thread = None
+
+    def log(self, record):
+        """Ставит запись (RequestRecord) в очередь на запись; не блокируется на диске."""
+        if self._file is None:
+            return
+        if record.status < 500 and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            with self._lock:
+                self.sampled_out += 1
+            return
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(record)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def start(self):
+        """Открывает файл журнала и запускает поток записи (вызывать в каждом процессе)."""
+        if not self.path or self._thread is not None:
+            return
+        # O_APPEND: процессы prefork пишут в один файл, и каждая пачка уходит одним write()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._write_loop, name="access-log", daemon=True)
+        self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch or self._file is None:
+            return
+        lines = [json.dumps(record.as_dict(), separators=(",", ":")) + "\n" for record in batch]
+        try:
+            self._file.write("".join(lines))
+            self._file.flush()
+        except (OSError, ValueError) as e:
+            print(f"Writing access log {self.path} failed: {e}")
+            return
+        self.written += len(batch)
+
+    def close(self):
+        """Дописывает накопленное; вызывается при остановке сервера."""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "path": self.path,
+            "sample_rate": self.sample_rate,
+            "written": self.written,
+            "pending": pending,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+        }
+
+
+ACCESS_LOG = AccessLog()
+
+
+class RequestRecord:
+    """Один обслуженный запрос: попадает в журнал доступа и в REQUEST_TIMINGS после отправки."""
+    __slots__ = ("time", "client", "method", "path", "status", "bytes", "parse", "file", "send")
+
+    def __init__(self, client, method, path, status, size, parse, file):
+        self.time = time.time()
+        self.client = client
+        self.method = method
+        self.path = path
+        self.status = status
+        self.bytes = size
+        self.parse = parse
+        self.file = file
+        self.send = 0.0
+
+    def as_dict(self):
+        client = f"{self.client[0]}:{self.client[1]}" if self.client else "-"
+        return {
+            "ts": email.utils.formatdate(self.time, usegmt=True),
+            "client": client,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "bytes": self.bytes,
+            "parse_ms": round(self.parse * 1000, 3),
+            "file_ms": round(self.file * 1000, 3),
+            "send_ms": round(self.send * 1000, 3),
+        }
+
+
+class PhaseTimer:
+    """Счётчик, сумма, максимум и гистограмма длительностей одной фазы обработки.
+
+    Корзины гистограммы — степени двойки в микросекундах, так что перцентили
+    приблизительные (верхняя граница корзины), зато запись — O(1) без хранения выборки.
+    """
+    BUCKETS = 25
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * self.BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)
+        self.histogram[bucket] += 1
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        threshold = self.count * p / 100
+        seen = 0
+        for bucket, n in enumerate(self.histogram):
+            seen += n
+            if seen >= threshold:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class RequestTimings:
+    """Сводка по фазам обработки запросов: разбор, работа с файлом, отправка.
+
+    Фаза send измеряется для пачки ответов конвейера целиком (они уходят вместе),
+    и каждому запросу пачки приписывается её длительность.
+    """
+    PHASES = ("parse", "file", "send")
+
+    def __init__(self):
+        self.requests = 0
+        self.status_codes = {}
+        self._phases = {phase: PhaseTimer() for phase in self.PHASES}
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        with self._lock:
+            self.requests += 1
+            self.status_codes[record.status] = self.status_codes.get(record.status, 0) + 1
+            self._phases["parse"].add(record.parse)
+            self._phases["file"].add(record.file)
+            self._phases["send"].add(record.send)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "status_codes": {str(code): n for code, n in sorted(self.status_codes.items())},
+                **{phase: timer.stats() for phase, timer in self._phases.items()},
+            }
+
+
+REQUEST_TIMINGS = RequestTimings()
+
+# Дополнительные разделы /__stats от конкретного сервера (например, статистика пула потоков)
+STATS_PROVIDERS = {}
+
+
+def stats_snapshot():
+    """Собирает JSON-совместимую сводку для /__stats."""
+    snapshot = {
+        "pid": os.getpid(),
+        "timings": REQUEST_TIMINGS.stats(),
+        "access_log": ACCESS_LOG.stats(),
+        "hot_cache": HOT_CACHE.stats(),
+        "gzip_cache": GZIP_CACHE.stats(),
+        "index": STATIC_INDEX.stats(),
+    }
+    for name, provider in STATS_PROVIDERS.items():
+        snapshot[name] = provider()
+    return snapshot
+
+
+def finish_requests(records, send_time):
+    """Учитывает отправленную пачку ответов в REQUEST_TIMINGS и журнале доступа."""
+    for record in records:
+        record.send = send_time
+        REQUEST_TIMINGS.record(record)
+        ACCESS_LOG.log(record)
+
+
+def get_content_type(filepath):
+    """Определяет Content-Type на основе расширения файла."""
+    return CONTENT_TYPES.get(os.path.splitext(filepath)[1].lower(), "application/octet-stream")
+
+def error_response(status, detail=""):
+    """Возвращает (статус, заголовки, тело) HTML-страницы с ошибкой."""
+    body = f"<html><body><h1>{status}</h1>{detail}</body></html>".encode('utf-8')
+    headers = {
+        "Content-Type": "text/html; charset=utf-8",
+        "Content-Length": str(len(body)),
+    }
+    return status, headers, body
+
+def http_date(timestamp):
+    """Форматирует время в виде HTTP-date (RFC 9110), например для Last-Modified."""
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+def accepts_gzip(request_headers):
+    """Разбирает Accept-Encoding с учётом q-значений: готов ли клиент принять gzip."""
+    accept_encoding = request_headers.get("accept-encoding")
+    if not accept_encoding:
+        return False
+    star = None
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        if coding in ("gzip", "x-gzip"):
+            return q > 0
+        if coding == "*":
+            star = q
+    return star is not None and star > 0
+
+def negotiation_key(path, request_headers):
+    """Ключ кэша горячих файлов: один путь даёт разные ответы клиентам с gzip и без."""
+    return path, accepts_gzip(request_headers)
+
+def is_compressible(content_type, size):
+    return size >= GZIP_MIN_SIZE and content_type.split(";")[0] in GZIP_TYPES
+
+def gzip_variant(f, st, entry, etag):
+    """Подбирает сжатый вариант файла: соседний .gz или сжатие на лету через GZIP_CACHE.
+
+    Возвращает (тело, длина, etag_варианта) и тогда закрывает f, либо None, если
+    выгоднее отдать файл как есть.
+    """
+    gz_file = None
+    gz_entry = STATIC_INDEX.lookup(entry.url_path + ".gz")
+    if gz_entry is not None:
+        try:
+            gz_file = open(gz_entry.filepath, 'rb')
+        except OSError:
+            gz_file = None
+    if gz_file is not None:
+        gz_st = os.fstat(gz_file.fileno())
+        # Устаревший .gz (старше исходника) не отдаём
+        if gz_st.st_mtime_ns >= st.st_mtime_ns:
+            f.close()
+            return FileBody(gz_file, 0, gz_st.st_size), gz_st.st_size, make_etag(gz_st)
+        gz_file.close()
+
+    if st.st_size > GZIP_MAX_SIZE:
+        return None
+    key = (entry.filepath, st.st_mtime_ns, st.st_size)
+    data = GZIP_CACHE.get(key)
+    if data is None:
+        f.seek(0)
+        data = gzip.compress(f.read(), compresslevel=GZIP_LEVEL, mtime=0)
+        GZIP_CACHE.put(key, data)
+    if len(data) >= st.st_size:
+        return None
+    f.close()
+    return data, len(data), etag[:-1] + '-gzip"'
+
+def make_etag(st):
+    """Строгий ETag из inode, размера и mtime: меняется при любой перезаписи файла."""
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+def is_not_modified(request_headers, etag, mtime):
+    """Проверяет If-None-Match (приоритетнее) и If-Modified-Since: True — можно ответить 304."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Для GET сравнение слабое: префикс W/ не учитывается
+        candidates = (tag.strip() for tag in if_none_match.split(","))
+        return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
+
+def parse_range(range_header, size):
+    """Разбирает заголовок Range для файла длины size.
+
+    Возвращает список включительных диапазонов (начало, конец), [] — если ни один
+    диапазон не попадает в файл (ответ 416), None — если заголовок некорректен
+    или диапазонов слишком много и его следует проигнорировать (ответ 200).
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    ranges = []
+    for item in spec.split(","):
+        first, dash, last = item.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+            else:
+                suffix = int(last)
+                start, end = max(size - suffix, 0), size - 1
+                if suffix == 0:
+                    continue
+        except ValueError:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+def if_range_matches(if_range, etag, st):
+    """Проверяет валидатор If-Range: при несовпадении вместо 206 отдаётся весь файл."""
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # If-Range требует строгого сравнения, слабые ETag не подходят
+        return if_range == etag
+    return if_range == http_date(st.st_mtime)
+
+def range_response(f, st, content_type, validators, ranges):
+    """Ответ 206 с одним диапазоном или multipart/byteranges с несколькими."""
+    size = st.st_size
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers = {
+            "Content-Type": content_type,
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1),
+            "Accept-Ranges": "bytes",
+            **validators,
+        }
+        return "206 Partial Content", headers, FileBody(f, start, end - start + 1)
+
+    boundary = uuid.uuid4().hex
+    body = []
+    length = 0
+    for i, (start, end) in enumerate(ranges):
+        part_head = (f"--{boundary}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode('utf-8')
+        body.append(part_head)
+        body.append(FileBody(f, start, end - start + 1, owner=(i == len(ranges) - 1)))
+        body.append(b"\r\n")
+        length += len(part_head) + end - start + 1 + 2
+    closing = f"--{boundary}--\r\n".encode('utf-8')
+    body.append(closing)
+    length += len(closing)
+    headers = {
+        "Content-Type": f"multipart/byteranges; boundary={boundary}",
+        "Content-Length": str(length),
+        "Accept-Ranges": "bytes",
+        **validators,
+    }
+    return "206 Partial Content", headers, body
+
+def file_response(f, st, entry, cache_key, request_headers):
+    """Строит ответ по открытому файлу из индекса; файл закрывается здесь либо отправителем тела."""
+    content_type = entry.content_type
+    etag = make_etag(st)
+    last_modified = http_date(st.st_mtime)
+    range_header = request_headers.get("range")
+    vary = {"Vary": "Accept-Encoding"} if is_compressible(content_type, st.st_size) else {}
+
+    # Диапазоны считаются по несжатому файлу, поэтому с Range отдаём его как есть
+    if vary and range_header is None and accepts_gzip(request_headers):
+        encoded = gzip_variant(f, st, entry, etag)
+        if encoded is not None:
+            body, length, gz_etag = encoded
+            validators = {"ETag": gz_etag, "Last-Modified": last_modified}
+            if is_not_modified(request_headers, gz_etag, st.st_mtime):
+                if isinstance(body, FileBody):
+                    body.close()
+                return "304 Not Modified", {**vary, **validators}, b""
+            headers = {
+                "Content-Type": content_type,
+                "Content-Encoding": "gzip",
+                "Content-Length": str(length),
+                **vary,
+                **validators,
+            }
+            if isinstance(body, bytes):
+                HOT_CACHE.put(cache_key, entry.filepath, st, format_head("200 OK", headers), body,
+                              gz_etag, format_head("304 Not Modified", {**vary, **validators}))
+            return "200 OK", headers, body
+
+    validators = {"ETag": etag, "Last-Modified": last_modified}
+    if is_not_modified(request_headers, etag, st.st_mtime):
+        f.close()
+        return "304 Not Modified", {**vary, **validators}, b""
+
+    if range_header is not None:
+        if_range = request_headers.get("if-range")
+        ranges = None
+        if if_range is None or if_range_matches(if_range, etag, st):
+            ranges = parse_range(range_header, st.st_size)
+        if ranges == []:
+            f.close()
+            status, headers, body = error_response("416 Range Not Satisfiable")
+            headers["Content-Range"] = f"bytes */{st.st_size}"
+            return status, headers, body
+        if ranges:
+            return range_response(f, st, content_type, validators, ranges)
+
+    headers = {
+        "Content-Type": content_type,
+        "Content-Length": str(st.st_size),
+        "Accept-Ranges": "bytes",
+        **vary,
+        **validators,
+    }
+    if st.st_size > HOT_CACHE.max_file_size or range_header is not None:
+        return "200 OK", headers, FileBody(f, 0, st.st_size)
+
+    with f:
+        f.seek(0)
+        file_content = f.read()
+    headers["Content-Length"] = str(len(file_content))
+    if len(file_content) == st.st_size:
+        HOT_CACHE.put(cache_key, entry.filepath, st, format_head("200 OK", headers), file_content,
+                      etag, format_head("304 Not Modified", {**vary, **validators}))
+    return "200 OK", headers, file_content
+
+def handle_request(method, requested_path, request_headers):
+    """Обрабатывает HTTP-запрос и возвращает кортеж (статус, заголовки, тело_ответа).
+
+    Тело — bytes для коротких служебных страниц, FileBody для файлов из WEB_ROOT
+    или список из bytes и FileBody для multipart/byteranges; FileBody закрывает тот,
+    кто отправляет ответ. Заголовок Connection выставляет
+    уровень соединения (см. build_response_head).
+    """
+    try:
+        if method != "GET":
+            return error_response("501 Not Implemented")
+
+        cache_key = negotiation_key(requested_path, request_headers)
+        url_path = unquote(requested_path.split("?", 1)[0])
+        if url_path == "/":
+            url_path = "/index.html"
+
+        # Индекс содержит только файлы внутри WEB_ROOT, так что ".." достаточно отсечь по строке
+        if ".." in url_path.split("/"):
+            return error_response("403 Forbidden")
+
+        entry = STATIC_INDEX.lookup(url_path)
+        if entry is None:
+            return error_response("404 Not Found", f"<p>File requested: {requested_path}</p>")
+
+        try:
+            f = open(entry.filepath, 'rb')
+        except FileNotFoundError:
+            # Файл удалён после последнего сканирования индекса
+            return error_response("404 Not Found", f"<p>File requested: {requested_path}</p>")
+        except IOError as e:
+            print(f"Error reading file {entry.filepath}: {e}")
+            return error_response("500 Internal Server Error", "<p>Could not read file.</p>")
+        try:
+            st = os.fstat(f.fileno())
+            return file_response(f, st, entry, cache_key, request_headers)
+        except Exception:
+            f.close()
+            raise
+
+    except Exception as e:
+        print(f"Error processing request: {e}")
+        return error_response("500 Internal Server Error", "<p>An error occurred while processing the request.</p>")
+
+def wants_keep_alive(version, headers):
+    """HTTP/1.1 держит соединение по умолчанию, HTTP/1.0 — только по явной просьбе клиента."""
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.1":
+        return "close" not in connection
+    return "keep-alive" in connection
+
+def format_head(status, headers):
+    """Собирает статусную строку и заголовки ответа без Connection и пустой строки в конце."""
+    response_lines = [f"HTTP/1.1 {status}\r\n"]
+    for key, value in headers.items():
+        response_lines.append(f"{key}: {value}\r\n")
+    return "".join(response_lines).encode('utf-8')
+
+def build_response_head(status, headers, keep_alive=False):
+    """Собирает байты статусной строки и заголовков HTTP-ответа."""
+    return format_head(status, headers) + (CONNECTION_KEEP_ALIVE if keep_alive else CONNECTION_CLOSE)
+
+def close_parts(parts):
+    """Закрывает файлы ещё не отправленных частей ответа."""
+    for part in parts:
+        if isinstance(part, FileBody):
+            part.close()
+
+def send_parts(sock, parts):
+    """Отправляет части ответа в блокирующий сокет и закрывает их файлы."""
+    try:
+        for i, part in enumerate(parts):
+            if isinstance(part, FileBody):
+                part.send_blocking(sock)
+            else:
+                more = i + 1 < len(parts)
+                sock.sendall(part, MSG_MORE if more else 0)
+    finally:
+        close_parts(parts)
+
+def new_request_buffer():
+    return HttpBuffer(max_header_size=MAX_HEADER_SIZE)
+
+def take_request(buf):
+    """Извлекает из буфера соединения (HttpBuffer) первый полностью принятый заголовок запроса.
+
+    Возвращает (метод, путь, версия, заголовки) или None, если заголовок ещё не дочитан.
+    Тело (для GET его нет) пропускается через buf.discard() по мере поступления,
+    чтобы не сбить разбор следующего запроса в конвейере.
+    """
+    head = buf.next_head(RequestHead)
+    if head is None:
+        return None
+    method, path, version, headers = head.method, head.target, head.version, head.headers
+
+    if "transfer-encoding" in headers:
+        raise BadRequest("Chunked request bodies are not supported")
+    try:
+        body_length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise BadRequest("Invalid Content-Length")
+    if body_length < 0 or body_length > MAX_BODY_SIZE:
+        raise BadRequest("Invalid Content-Length")
+
+    if body_length:
+        buf.discard(body_length)
+    return method, path, version, headers
+
+def stats_response(keep_alive):
+    body = json.dumps(stats_snapshot(), indent=2).encode('utf-8')
+    headers = {
+        "Content-Type": "application/json",
+        "Content-Length": str(len(body)),
+        "Cache-Control": "no-store",
+    }
+    return build_response_head("200 OK", headers, keep_alive), body
+
+def body_size(body):
+    """Число байт тела ответа: bytes, FileBody или список из них (multipart/byteranges)."""
+    if isinstance(body, list):
+        return sum(body_size(piece) for piece in body)
+    if isinstance(body, FileBody):
+        return body.count
+    return len(body)
+
+def respond(method, path, headers, keep_alive):
+    """Возвращает (байты_заголовка, тело) ответа на один запрос; горячие файлы берутся из HOT_CACHE."""
+    if method == "GET" and path == STATS_PATH:
+        return stats_response(keep_alive)
+    if method == "GET" and "range" not in headers:
+        entry = HOT_CACHE.get(negotiation_key(path, headers))
+        if entry is not None:
+            connection = CONNECTION_KEEP_ALIVE if keep_alive else CONNECTION_CLOSE
+            if is_not_modified(headers, entry.etag, entry.mtime):
+                return entry.not_modified_head + connection, b""
+            return entry.head + connection, entry.content
+    status, headers, body = handle_request(method, path, headers)
+    return build_response_head(status, headers, keep_alive), body
+
+def respond_to_buffered(buf, served, client_address=None):
+    """Отвечает на все запросы, полностью лежащие в buf, в порядке их поступления.
+
+    Возвращает (части_ответов, записи_о_запросах, держать_ли_соединение).
+    Части — bytes или FileBody; соседние bytes склеиваются, чтобы ответы конвейера
+    уходили минимальным числом системных вызовов. Записи (RequestRecord) передаются
+    в finish_requests, когда части отправлены.
+    """
+    parts = []
+    pending = []
+    records = []
+    keep_alive = True
+    while keep_alive:
+        started = time.perf_counter()
+        try:
+            taken = take_request(buf)
+        except HttpParseError:
+            status, headers, body = error_response("400 Bad Request")
+            head = build_response_head(status, headers)
+            pending.append(head)
+            pending.append(body)
+            records.append(RequestRecord(client_address, "-", "-", 400, len(head) + len(body),
+                                         time.perf_counter() - started, 0.0))
+            keep_alive = False
+            break
+        if taken is None:
+            break
+
+        method, path, version, headers = taken
+        parsed = time.perf_counter()
+        keep_alive = wants_keep_alive(version, headers) and served + len(records) + 1 < KEEPALIVE_MAX_REQUESTS
+        head, body = respond(method, path, headers, keep_alive)
+        records.append(RequestRecord(client_address, method, path, int(head[9:12]), len(head) + body_size(body),
+                                     parsed - started, time.perf_counter() - parsed))
+        pending.append(head)
+        for piece in (body if isinstance(body, list) else (body,)):
+            if isinstance(piece, FileBody):
+                parts.append(b"".join(pending))
+                parts.append(piece)
+                pending = []
+            else:
+                pending.append(piece)
+
+    if pending:
+        parts.append(b"".join(pending))
+    return parts, records, keep_alive
+
+def serve_connection(client_socket, client_address, yield_idle=None):
+    """Обслуживает постоянное соединение: конвейер запросов, тайм-аут простоя и лимит запросов.
+
+    yield_idle — необязательная функция без аргументов; если между запросами она
+    вернёт True, простаивающее соединение закрывается и освобождает поток
+    для клиентов, ждущих своей очереди.
+    """
+    poll_interval = IDLE_POLL_INTERVAL if yield_idle is not None else KEEPALIVE_TIMEOUT
+    buf = new_request_buffer()
+    served = 0
+    idle_since = time.monotonic()
+    while True:
+        client_socket.settimeout(poll_interval)
+        try:
+            received = buf.fill(client_socket)
+        except socket.timeout:
+            if time.monotonic() - idle_since >= KEEPALIVE_TIMEOUT:
+                return
+            if not buf and not buf.skipping and yield_idle():
+                return
+            continue
+        if not received:
+            return
+
+        parts, records, keep_alive = respond_to_buffered(buf, served, client_address)
+        if parts:
+            client_socket.settimeout(KEEPALIVE_TIMEOUT)
+            send_started = time.perf_counter()
+            send_parts(client_socket, parts)
+            finish_requests(records, time.perf_counter() - send_started)
+            served += len(records)
+        if not keep_alive:
+            return
+        idle_since = time.monotonic()
@@ -0,0 +1,179 @@
+"""Скомпилированный чёрный список для proxy_blacklist.py.
+
+Строки blacklist.txt делятся на два вида. Доменное имя (badexample.com)
+блокирует сам домен и все его поддомены; такие записи лежат в дереве по
+меткам домена, начиная с зоны верхнего уровня (com -> badexample), и проверка
+хоста стоит столько шагов, сколько в нём меток. Всё остальное — подстроки URL;
+они собраны в автомат Ахо — Корасик, который проходит URL один раз, сколько бы
+записей ни было в списке.
+
+BlacklistFile следит за файлом: раз в check_interval секунд сверяет mtime и
+размер и при изменении собирает новый список в отдельном потоке, после чего
+подменяет его одним присваиванием. Запросы всё это время проверяются по
+прежнему списку.
+"""
+import asyncio
+import os
+import re
+import time
+from urllib.parse import urlsplit
+
+RELOAD_CHECK_INTERVAL = 1.0
+DOMAIN_RE = re.compile(r"^[a-z0-9-]+(\.[a-z0-9-]+)+$")
+# Ключ узла дерева доменов, отмечающий конец записи (метки домена не бывают пустыми)
+END = ""
+
+
+class DomainTrie:
+    """Дерево доменов по меткам в обратном порядке."""
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def add(self, domain: str):
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, {})
+        if END not in node:
+            node[END] = True
+            self.size += 1
+
+    def matches(self, host: str) -> bool:
+        """True, если host совпадает с одним из доменов или является его поддоменом."""
+        node = self.root
+        for label in reversed(host.rstrip(".").split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if END in node:
+                return True
+        return False
+
+
+class SubstringMatcher:
+    """Автомат Ахо — Корасик: есть ли в тексте хотя бы одна из подстрок."""
+
+    def __init__(self, patterns: list[str]):
+        # Состояние — индекс в списках: переходы, ссылка неудачи, заканчивается ли здесь подстрока
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [False]
+        for pattern in patterns:
+            self._add(pattern)
+        self._link()
+
+    def _add(self, pattern: str):
+        state = 0
+        for ch in pattern:
+            next_state = self.goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(False)
+                self.goto[state][ch] = next_state
+            state = next_state
+        self.output[state] = True
+
+    def _link(self):
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                # Подстрока, оканчивающаяся в суффиксе, тоже найдена
+                self.output[child] = self.output[child] or self.output[self.fail[child]]
+                queue.append(child)
+
+    def contains(self, text: str) -> bool:
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                return True
+        return False
+
+
+class CompiledBlacklist:
+    def __init__(self, entries: list[str]):
+        self.domains = DomainTrie()
+        substrings = []
+        for entry in entries:
+            if DOMAIN_RE.match(entry.lower()):
+                self.domains.add(entry.lower())
+            else:
+                substrings.append(entry)
+        self.substrings = SubstringMatcher(substrings)
+        self.substring_count = len(substrings)
+
+    def blocked(self, url: str) -> bool:
+        host = urlsplit(url).hostname or ""
+        return self.domains.matches(host) or self.substrings.contains(url)
+
+
+def load_entries(path: str) -> list[str]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as bl:
+        return [l.strip() for l in bl if l.strip() and not l.startswith("#")]
+
+
+class BlacklistFile:
+    """Чёрный список из файла, пересобираемый при изменении файла без перезапуска прокси."""
+
+    def __init__(self, path: str, check_interval: float = RELOAD_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._signature = self._stat()
+        self._checked = time.monotonic()
+        self._reloading = False
+        self._task = None
+        self.matcher = CompiledBlacklist(load_entries(path))
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def blocked(self, url: str) -> bool:
+        self.check()
+        return self.matcher.blocked(url)
+
+    def check(self):
+        """Не чаще раза в check_interval сверяет файл и при изменении запускает пересборку."""
+        now = time.monotonic()
+        if self._reloading or now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        signature = self._stat()
+        if signature == self._signature:
+            return
+        self._signature = signature
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.matcher = CompiledBlacklist(load_entries(self.path))
+            self.reloads += 1
+            return
+        self._reloading = True
+        self._task = loop.create_task(self._reload(loop))
+
+    async def _reload(self, loop):
+        try:
+            self.matcher = await loop.run_in_executor(None, lambda: CompiledBlacklist(load_entries(self.path)))
+            self.reloads += 1
+            print(f"Blacklist reloaded: {self.matcher.domains.size} domains, "
+                  f"{self.matcher.substring_count} substrings")
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Blacklist reload failed: {e}")
+        finally:
+            self._reloading = False
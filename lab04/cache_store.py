@@ -0,0 +1,359 @@
+"""Хранилище кэша прокси из lab04: память перед диском.
+
+Метаданные всех объектов (заголовки, размер, свежесть, число и время
+обращений) лежат в одном индексе SQLite в режиме WAL. Индекс целиком читается
+в память при запуске, так что поиск объекта не делает ни одного обращения
+к файловой системе. Тела лежат в подкаталогах по первым байтам ключа:
+ab/cd/<hash> — ни в одном каталоге не оказывается миллионов файлов.
+
+Суммарный размер тел ограничен max_bytes: при переполнении удаляются объекты,
+к которым дольше всего не обращались (lru) или обращались реже всего (lfu),
+сразу с запасом до DISK_LOW_WATERMARK. Объект больше max_object (по умолчанию
+та доля max_bytes, что освобождает одно вытеснение) не сохраняется вовсе,
+иначе он вытеснил бы всё остальное. Небольшие горячие тела дополнительно
+лежат в памяти (LRU по байтам), так что повторное попадание не читает файл.
+
+Запись атомарна: тело пишется во временный файл в tmp/ и подменяет прежнюю
+версию через os.replace только целиком, после чего в индекс записывается
+строка объекта. Счётчики обращений сбрасываются в индекс пачками (flush).
+"""
+import collections
+import itertools
+import json
+import os
+import sqlite3
+import time
+from typing import BinaryIO
+
+CACHE_DIR = "lab04_cache"
+DISK_MAX_BYTES = 1024 * 1024 * 1024
+MEMORY_MAX_BYTES = 32 * 1024 * 1024
+MEMORY_MAX_OBJECT = 256 * 1024
+DISK_LOW_WATERMARK = 0.9
+EVICTION_POLICIES = ("lru", "lfu")
+INDEX_FILE = "index.sqlite3"
+# Счётчики обращений пишутся в индекс, когда набралось FLUSH_BATCH объектов или прошло FLUSH_INTERVAL секунд
+FLUSH_BATCH = 256
+FLUSH_INTERVAL = 5.0
+
+
+class DiskEntry:
+    __slots__ = ("size", "last_access", "hits", "meta")
+
+    def __init__(self, size: int, last_access: float, hits: int, meta: dict):
+        self.size = size
+        self.last_access = last_access
+        self.hits = hits
+        self.meta = meta
+
+
+class MemoryTier:
+    """LRU тел объектов в памяти с ограничением суммарного размера."""
+
+    def __init__(self, max_bytes: int = MEMORY_MAX_BYTES, max_object: int = MEMORY_MAX_OBJECT):
+        self.max_bytes = max_bytes
+        self.max_object = max_object
+        self.evictions = 0
+        self._bodies = collections.OrderedDict()
+        self._size = 0
+
+    def get(self, key: str) -> bytes | None:
+        body = self._bodies.get(key)
+        if body is not None:
+            self._bodies.move_to_end(key)
+        return body
+
+    def put(self, key: str, body: bytes):
+        if len(body) > self.max_object or len(body) > self.max_bytes:
+            self.remove(key)
+            return
+        self.remove(key)
+        self._bodies[key] = body
+        self._size += len(body)
+        while self._size > self.max_bytes:
+            oldest = next(iter(self._bodies))
+            self.remove(oldest)
+            self.evictions += 1
+
+    def remove(self, key: str):
+        body = self._bodies.pop(key, None)
+        if body is not None:
+            self._size -= len(body)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._bodies), "bytes": self._size, "evictions": self.evictions}
+
+
+class CacheWriter:
+    """Запись тела нового объекта; видимой она становится только после commit().
+
+    Когда тело перерастает store.max_object, временный файл удаляется (dropped),
+    но запись в уже открытый файл продолжается: его дочитывают клиенты, которые
+    получают тело по ходу загрузки. commit() такого объекта ничего не сохраняет.
+    """
+
+    def __init__(self, store: "CacheStore", key: str, meta: dict, tmp_path: str):
+        self.store = store
+        self.key = key
+        self.meta = meta
+        self.tmp_path = tmp_path
+        self.size = 0
+        # Без буферизации: пока идёт запись, этот же файл читают клиенты (см. proxy_cache.DownloadBody)
+        self.out = open(tmp_path, "wb", buffering=0)
+        # Небольшое тело сразу попадёт и в память
+        self.kept = []
+        self.dropped = False
+
+    def write(self, data: bytes):
+        self.out.write(data)
+        self.size += len(data)
+        if not self.dropped and self.size > self.store.max_object:
+            self.dropped = True
+            self.kept = None
+            self.store.oversize += 1
+            self.store._unlink(self.tmp_path)
+        if self.kept is not None:
+            if self.size <= self.store.memory.max_object:
+                self.kept.append(data)
+            else:
+                self.kept = None
+
+    def commit(self):
+        if self.out is None:
+            return
+        self.out.close()
+        self.out = None
+        if self.dropped:
+            return
+        body = b"".join(self.kept) if self.kept is not None else None
+        self.store._commit(self.key, self.meta, self.tmp_path, self.size, body)
+
+    def abort(self):
+        if self.out is None:
+            return
+        self.out.close()
+        self.out = None
+        if not self.dropped:
+            self.store.aborted += 1
+            self.store._unlink(self.tmp_path)
+
+
+class CacheStore:
+    """Двухуровневый кэш объектов по ключу (sha256 от URL)."""
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = DISK_MAX_BYTES,
+                 memory_bytes: int = MEMORY_MAX_BYTES, memory_max_object: int = MEMORY_MAX_OBJECT,
+                 policy: str = "lru", max_object: int | None = None):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object = max_object if max_object is not None else int(max_bytes * (1 - DISK_LOW_WATERMARK))
+        self.policy = policy
+        self.memory = MemoryTier(memory_bytes, memory_max_object)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+        self.aborted = 0
+        self.oversize = 0
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._dirty = set()
+        self._last_flush = time.monotonic()
+        self._shards = set()
+        self._tmp_counter = itertools.count()
+        self.tmp_dir = os.path.join(directory, "tmp")
+        self._prepare_directory()
+        self._db = sqlite3.connect(os.path.join(directory, INDEX_FILE), isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                         "hits INTEGER NOT NULL, last_access REAL NOT NULL, meta TEXT NOT NULL)")
+        self._load()
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def body_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:4], key)
+
+    def _prepare_directory(self):
+        """Создаёт каталоги; недописанные временные файлы прошлых запусков удаляются.
+
+        Файлы плоской раскладки <hash>.body / <hash>.meta (до индекса) удаляются при первом
+        запуске с индексом.
+        """
+        first_run = not os.path.exists(os.path.join(self.directory, INDEX_FILE))
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        for name in os.listdir(self.tmp_dir):
+            self._unlink(os.path.join(self.tmp_dir, name))
+        if first_run:
+            for name in os.listdir(self.directory):
+                if name.endswith((".body", ".meta", ".tmp")):
+                    self._unlink(os.path.join(self.directory, name))
+
+    def _load(self):
+        rows = self._db.execute("SELECT key, size, hits, last_access, meta FROM entries ORDER BY last_access")
+        for key, size, hits, last_access, meta in rows:
+            self._entries[key] = DiskEntry(size, last_access, hits, json.loads(meta))
+            self._size += size
+
+    def get_meta(self, key: str, count_miss: bool = True) -> dict | None:
+        """Метаданные объекта (копия) или None (промах; count_miss=False — не считать его в misses)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            if count_miss:
+                self.misses += 1
+            return None
+        return dict(entry.meta)
+
+    def open_body(self, key: str) -> bytes | BinaryIO | None:
+        """Тело объекта для отправки: bytes из памяти или с диска, если оно небольшое
+        (тогда оно попадает и в память), иначе открытый файл — его отправляют через sendfile.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        body = self.memory.get(key)
+        if body is not None:
+            self.memory_hits += 1
+        else:
+            try:
+                f = open(self.body_path(key), "rb")
+            except OSError:
+                # Тело пропало с диска — убираем и строку индекса
+                self.remove(key)
+                return None
+            self.disk_hits += 1
+            if entry.size <= self.memory.max_object:
+                with f:
+                    body = f.read()
+                self.memory.put(key, body)
+            else:
+                body = f
+        self._touch(key, entry)
+        return body
+
+    def read_body(self, key: str) -> bytes | None:
+        """Тело объекта целиком в памяти."""
+        body = self.open_body(key)
+        if body is None or isinstance(body, bytes):
+            return body
+        with body:
+            return body.read()
+
+    def open_writer(self, key: str, meta: dict) -> CacheWriter:
+        tmp_path = os.path.join(self.tmp_dir, f"{key}.{os.getpid()}.{next(self._tmp_counter)}")
+        return CacheWriter(self, key, meta, tmp_path)
+
+    def update_meta(self, key: str, meta: dict):
+        """Перезаписывает метаданные существующего объекта (например, после 304)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        meta["size"] = entry.size
+        entry.meta = meta
+        self._db.execute("UPDATE entries SET meta = ? WHERE key = ?", (json.dumps(meta), key))
+
+    def remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._dirty.discard(key)
+        self.memory.remove(key)
+        self._unlink(self.body_path(key))
+
+    def _commit(self, key: str, meta: dict, tmp_path: str, size: int, body: bytes | None):
+        if size > self.max_object:
+            self.oversize += 1
+            self._unlink(tmp_path)
+            return
+        meta["size"] = size
+        path = self.body_path(key)
+        shard = os.path.dirname(path)
+        if shard not in self._shards:
+            os.makedirs(shard, exist_ok=True)
+            self._shards.add(shard)
+        os.replace(tmp_path, path)
+        now = time.time()
+        self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, 0, ?, ?)", (key, size, now, json.dumps(meta)))
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= old.size
+        self._entries[key] = DiskEntry(size, now, 0, meta)
+        self._size += size
+        self._dirty.discard(key)
+        self.writes += 1
+        if body is not None:
+            self.memory.put(key, body)
+        else:
+            self.memory.remove(key)
+        if self._size > self.max_bytes:
+            # Только что записанный объект ещё ни разу не читали — для lfu он был бы первой жертвой
+            self._evict(keep=key)
+
+    def _touch(self, key: str, entry: DiskEntry):
+        entry.last_access = time.time()
+        entry.hits += 1
+        self._entries.move_to_end(key)
+        self._dirty.add(key)
+        if len(self._dirty) >= FLUSH_BATCH or time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Записывает в индекс накопившиеся счётчики обращений."""
+        self._last_flush = time.monotonic()
+        if not self._dirty:
+            return
+        rows = [(self._entries[key].hits, self._entries[key].last_access, key) for key in self._dirty]
+        self._dirty.clear()
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany("UPDATE entries SET hits = ?, last_access = ? WHERE key = ?", rows)
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def _evict(self, keep: str | None = None):
+        """Удаляет объекты, пока размер не опустится до DISK_LOW_WATERMARK от max_bytes."""
+        target = self.max_bytes * DISK_LOW_WATERMARK
+        if self.policy == "lru":
+            # _entries упорядочен по времени последнего обращения
+            victims = iter(list(self._entries))
+        else:
+            victims = iter(sorted(self._entries, key=lambda k: (self._entries[k].hits, self._entries[k].last_access)))
+        with self._db:
+            self._db.execute("BEGIN")
+            for key in victims:
+                if self._size <= target:
+                    break
+                if key == keep:
+                    continue
+                self.remove(key)
+                self.evictions += 1
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "policy": self.policy,
+            "memory": self.memory.stats(),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "writes": self.writes,
+            "aborted": self.aborted,
+            "oversize": self.oversize,
+        }
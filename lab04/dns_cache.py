@@ -0,0 +1,140 @@
+"""Кэш DNS для соединений прокси из lab04 с серверами назначения.
+
+Имя сервера разрешается через getaddrinfo в пуле потоков цикла событий, чтобы
+блокирующий резолвер libc не останавливал остальные соединения. Ответ
+хранится DNS_POSITIVE_TTL секунд, ошибка разрешения — DNS_NEGATIVE_TTL:
+getaddrinfo не сообщает TTL записей, поэтому сроки фиксированные и короткие.
+Пока имя разрешается, остальные запросы к нему ждут тот же поиск, а не
+запускают свой. Адреса хранятся без порта, так что записью пользуются
+соединения с любым портом хоста.
+"""
+import asyncio
+import ipaddress
+import socket
+import time
+
+DNS_POSITIVE_TTL = 60.0
+DNS_NEGATIVE_TTL = 5.0
+DNS_MAX_ENTRIES = 1024
+
+
+def with_port(address: tuple, port: int) -> tuple:
+    """Адрес сокета из getaddrinfo с подставленным портом (у IPv6 их четыре поля)."""
+    return (address[0], port) + tuple(address[2:])
+
+
+def interleave(infos: list) -> list:
+    """Чередует семейства адресов (AAAA, A, AAAA, ...), сохраняя порядок резолвера внутри семейства."""
+    families = {}
+    for info in infos:
+        families.setdefault(info[0], []).append(info)
+    queues = list(families.values())
+    result = []
+    while queues:
+        for queue in queues:
+            result.append(queue.pop(0))
+        queues = [queue for queue in queues if queue]
+    return result
+
+
+class DnsCache:
+    """Общий для всех соединений кэш имён с положительным и отрицательным TTL.
+
+    lookup — функция с сигнатурой socket.getaddrinfo; её вызовы считаются в lookups.
+    """
+
+    def __init__(self, positive_ttl: float = DNS_POSITIVE_TTL, negative_ttl: float = DNS_NEGATIVE_TTL,
+                 max_entries: int = DNS_MAX_ENTRIES, lookup=socket.getaddrinfo):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lookup = lookup
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.lookups = 0
+        # host -> (срок годности, список адресов или исключение)
+        self._entries = {}
+        self._inflight = {}
+
+    async def resolve(self, host: str, port: int) -> list:
+        """Адреса host в формате getaddrinfo (SOCK_STREAM) с портом port; ошибка — socket.gaierror."""
+        host = host.lower()
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            pass
+        else:
+            # IP-адрес разрешать не нужно, в кэш и счётчики он не попадает
+            family = socket.AF_INET6 if ":" in host else socket.AF_INET
+            address = (host, port, 0, 0) if family == socket.AF_INET6 else (host, port)
+            return [(family, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", address)]
+        infos = await self._lookup_cached(host)
+        return [(family, type_, proto, name, with_port(address, port))
+                for family, type_, proto, name, address in infos]
+
+    async def _lookup_cached(self, host: str) -> list:
+        entry = self._entries.get(host)
+        if entry is not None:
+            expires, result = entry
+            if time.monotonic() < expires:
+                if isinstance(result, Exception):
+                    self.negative_hits += 1
+                    raise socket.gaierror(*result.args)
+                self.hits += 1
+                return result
+            del self._entries[host]
+        task = self._inflight.get(host)
+        if task is None:
+            self.misses += 1
+            task = asyncio.get_running_loop().create_task(self._lookup(host))
+            self._inflight[host] = task
+            # Ошибку забирает каждый ждущий; если ждущих не осталось, забираем её сами
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self.coalesced += 1
+        # Отмена одного из ждущих (например, по таймауту соединения) не прерывает общий поиск
+        return await asyncio.shield(task)
+
+    async def _lookup(self, host: str) -> list:
+        try:
+            self.lookups += 1
+            loop = asyncio.get_running_loop()
+            infos = await loop.run_in_executor(None, self.lookup, host, None, 0, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            self._store(host, e, self.negative_ttl)
+            raise
+        finally:
+            del self._inflight[host]
+        # Без порта getaddrinfo может вернуть один адрес несколько раз — оставляем первый
+        unique = {}
+        for family, type_, proto, name, address in infos:
+            unique.setdefault((family, address), (family, type_, proto, name, address))
+        result = list(unique.values())
+        self._store(host, result, self.positive_ttl)
+        return result
+
+    def _store(self, host: str, result, ttl: float):
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        if len(self._entries) >= self.max_entries:
+            for name in [name for name, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[name]
+            while len(self._entries) >= self.max_entries:
+                # Словарь хранит порядок вставки: первым уходит самая старая запись
+                del self._entries[next(iter(self._entries))]
+        self._entries[host] = (now + ttl, result)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.negative_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "lookups": self.lookups,
+            "hit_rate": round((self.hits + self.negative_hits + self.coalesced) / requests, 3) if requests else 0.0,
+        }
@@ -1,186 +1,350 @@
-import socket
-import threading
+import asyncio
 import sys
-import os
 import time
 import hashlib
-import json
-from urllib.parse import urlsplit
+from email.utils import formatdate, parsedate_to_datetime
 
-CACHE_DIR = "lab04_cache"
-LOG_FILE = "proxy_cache.log"
-BUFFER = 8192
-
-os.makedirs(CACHE_DIR, exist_ok=True)
+from cache_store import DISK_MAX_BYTES, CacheStore
+from proxy_core import BUFFER_SIZE, FileBody, LoggingStage, ProxyLog, Response, header_name, parse_port, run_proxy
 
-def log(msg: str):
-    ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"[{ts}] {msg}\n")
+LOG_FILE = "proxy_cache.log"
+# Эвристическая свежесть без явного срока: доля от возраста по Last-Modified, но не больше суток
+HEURISTIC_FRACTION = 0.1
+HEURISTIC_MAX_LIFETIME = 24 * 3600
+# Заголовки ответа, которые хранятся в .meta и отдаются вместе с копией из кэша
+STORED_HEADERS = ("etag", "last-modified", "content-type", "content-encoding", "content-language",
+                  "content-location", "cache-control", "expires", "vary")
 
 def url_hash(url: str) -> str:
     return hashlib.sha256(url.encode()).hexdigest()
 
-def meta_path(h: str) -> str:
-    return os.path.join(CACHE_DIR, f"{h}.meta")
-
-def body_path(h: str) -> str:
-    return os.path.join(CACHE_DIR, f"{h}.body")
-
-def read_headers(sock: socket.socket) -> tuple[bytes, bytes]:
-    data = b""
-    while b"\r\n\r\n" not in data:
-        chunk = sock.recv(BUFFER)
-        if not chunk:
-            break
-        data += chunk
-    header_bytes, rest = data.split(b"\r\n\r\n", 1)
-    return header_bytes, rest
-
-def parse_headers(header_bytes: bytes):
-    lines = header_bytes.decode(errors="ignore").split("\r\n")
-    status_line = lines[0]
-    code = status_line.split()[1]
-    headers = {}
-    for l in lines[1:]:
-        if ":" in l:
-            k, v = l.split(":", 1)
-            headers[k.strip().lower()] = v.strip()
-    return status_line, code, headers
-
-def rebuild_request(method: str, path: str, proto: str, headers: dict[str,str], body: bytes):
-    lines = [f"{method} {path} {proto}"]
-    for k, v in headers.items():
-        if k == "proxy-connection":
-            continue
-        lines.append(f"{k.capitalize()}: {v}")
-    lines.append("Connection: close")
-    return "\r\n".join(lines).encode() + b"\r\n\r\n" + body
-
-def handle(client: socket.socket):
+
+def http_date(value: str | None) -> float | None:
+    """Время из HTTP-даты (Expires, Date, Last-Modified); None — если не разбирается."""
+    if not value:
+        return None
     try:
-        # read client request headers
-        req = b""
-        while b"\r\n\r\n" not in req:
-            chunk = client.recv(BUFFER)
-            if not chunk:
-                return
-            req += chunk
-        header_b, body = req.split(b"\r\n\r\n", 1)
-        first, *rest = header_b.decode(errors="ignore").split("\r\n")
-        method, url, proto = first.split()
-        hdrs = {}
-        for l in rest:
-            if ":" in l:
-                k, v = l.split(":", 1)
-                hdrs[k.strip().lower()] = v.strip()
-        if method.upper() == "POST" and "content-length" in hdrs:
-            length = int(hdrs["content-length"])
-            while len(body) < length:
-                body += client.recv(length - len(body))
-        if not url.startswith("http://") and "host" in hdrs:
-            url = f"http://{hdrs['host']}{url}"
-        p = urlsplit(url)
-        host, port = p.hostname, p.port or 80
-        path = p.path or "/"
-        if p.query:
-            path += f"?{p.query}"
-        hsh = url_hash(url)
-        meta_f, body_f = meta_path(hsh), body_path(hsh)
-
-        # Decide on conditional headers if cached
-        if os.path.exists(meta_f):
-            try:
-                with open(meta_f, "r", encoding="utf-8") as f:
-                    meta = json.load(f)
-                if "etag" in meta:
-                    hdrs["if-none-match"] = meta["etag"]
-                if "last-modified" in meta:
-                    hdrs["if-modified-since"] = meta["last-modified"]
-            except Exception:
-                pass
-        # Connect to origin
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def cache_control(value: str | None) -> dict[str, str]:
+    """Директивы Cache-Control: имена в нижнем регистре, значение без кавычек или ""."""
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip().strip('"')
+    return directives
+
+
+def seconds(value: str | None) -> int | None:
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def vary_names(headers: dict[str, str]) -> list[str] | None:
+    """Заголовки запроса из Vary ответа; None — Vary: *, копию нельзя отдать никакому другому запросу."""
+    names = [name.strip().lower() for name in headers.get("vary", "").split(",") if name.strip()]
+    return None if "*" in names else names
+
+
+def variant(request_headers: dict[str, str], names) -> dict[str, str]:
+    """Значения заголовков запроса, перечисленных в Vary, с нормализованными пробелами."""
+    return {name: " ".join(request_headers.get(name, "").split()) for name in names}
+
+
+def storable(headers: dict[str, str]) -> bool:
+    """Можно ли общему кэшу сохранять ответ с такими заголовками."""
+    cc = cache_control(headers.get("cache-control"))
+    return "no-store" not in cc and "private" not in cc and vary_names(headers) is not None
+
+
+def created_at(headers: dict[str, str], request_time: float, response_time: float) -> float:
+    """Когда ответ был создан на сервере: поправка на Age, Date и время в пути."""
+    date = http_date(headers.get("date")) or response_time
+    apparent_age = max(0.0, response_time - date)
+    corrected_age = (seconds(headers.get("age")) or 0) + (response_time - request_time)
+    return response_time - max(apparent_age, corrected_age)
+
+
+def freshness(headers: dict[str, str], created: float) -> float:
+    """Момент, до которого ответ свежий: s-maxage, max-age, Expires или эвристика по Last-Modified."""
+    cc = cache_control(headers.get("cache-control"))
+    if "no-cache" in cc:
+        return 0.0
+    lifetime = seconds(cc.get("s-maxage"))
+    if lifetime is None:
+        lifetime = seconds(cc.get("max-age"))
+    if lifetime is None and "expires" in headers:
+        date = http_date(headers.get("date")) or created
+        expires = http_date(headers["expires"])
+        # Неразбираемый Expires (например, "0") означает «уже устарел»
+        lifetime = max(0.0, expires - date) if expires is not None else 0
+    if lifetime is None:
+        date = http_date(headers.get("date")) or created
+        last_modified = http_date(headers.get("last-modified"))
+        if last_modified is None or last_modified > date:
+            return 0.0
+        lifetime = min((date - last_modified) * HEURISTIC_FRACTION, HEURISTIC_MAX_LIFETIME)
+    return created + lifetime
+
+
+def wants_revalidation(ex) -> bool:
+    """Клиент просит не отдавать копию из кэша без проверки (Ctrl+F5 и т.п.)."""
+    cc = cache_control(ex.headers.get("cache-control"))
+    return "no-cache" in cc or cc.get("max-age") == "0" or "no-cache" in ex.headers.get("pragma", "")
+
+
+def cached_response(body, meta: dict, note: str) -> Response:
+    """Ответ 200 из кэша; body — bytes или открытый файл из CacheStore.open_body."""
+    if not isinstance(body, bytes):
+        body = FileBody(body, meta["size"])
+    headers = [("Content-Length", str(meta["size"]))]
+    for name in STORED_HEADERS:
+        if meta.get(name):
+            headers.append((header_name(name), meta[name]))
+    headers.append(("Age", str(int(max(0, time.time() - meta.get("created", time.time()))))))
+    headers.append(("Date", formatdate(usegmt=True)))
+    return Response("HTTP/1.1 200 OK", headers, body, note=note)
+
+
+class Download:
+    """Загрузка объекта с сервера назначения, общая для всех клиентов, запросивших его одновременно.
+
+    Тело пишется через CacheWriter во временный файл; клиенты читают этот файл
+    по мере роста (DownloadBody), так что сервер получает один запрос, а не по
+    одному на клиента. Загрузку ведёт отдельная задача, и уход любого из клиентов,
+    включая первого, её не прерывает. variant — значения заголовков запроса из Vary
+    ответа (см. CacheStage._matching_meta): подключаются только клиенты с такими же.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.head_ready = asyncio.Event()
+        self.progress = asyncio.Condition()
+        self.status_line = None
+        self.headers = None
+        self.writer = None
+        self.variant = {}
+        self.size = 0
+        self.done = False
+        self.failed = False
+
+    @property
+    def streaming(self) -> bool:
+        """Тело ещё пишется во временный файл, и к нему можно подключиться.
+
+        Файл слишком большого для кэша объекта удалён (CacheWriter.dropped), и новые
+        клиенты идут к серверу сами.
+        """
+        return self.writer is not None and not self.writer.dropped and not self.done and not self.failed
+
+    async def run(self, body, on_finish):
         try:
-            origin = socket.create_connection((host, port))
+            async for chunk in body:
+                self.writer.write(chunk)
+                self.size += len(chunk)
+                async with self.progress:
+                    self.progress.notify_all()
+            self.writer.commit()
+            self.done = True
         except Exception:
-            client.sendall(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length:0\r\n\r\n")
-            log(f"{method} {url} -> 502")
-            return
-        origin_req = rebuild_request(method, path, proto, hdrs, body)
-        origin.sendall(origin_req)
-        # Read origin response headers first
-        hdr_bytes, remainder = read_headers(origin)
-        status_line, code, resp_headers = parse_headers(hdr_bytes)
-        cached = False
-        if code == "304" and os.path.exists(body_f):
-            # Serve from cache
-            with open(body_f, "rb") as f:
-                body_cached = f.read()
-            client.sendall(status_line.encode() + b"\r\n")
-            # rebuild headers, ensure correct len
-            resp_headers.pop("transfer-encoding", None)
-            resp_headers["content-length"] = str(len(body_cached))
-            for k, v in resp_headers.items():
-                client.sendall(f"{k.capitalize()}: {v}\r\n".encode())
-            client.sendall(b"\r\n" + body_cached)
-            cached = True
-            log(f"{method} {url} -> 200 (cache hit)")
-            origin.close()
-            return
-        else:
-            # Forward headers and remainder to client
-            client.sendall(hdr_bytes + b"\r\n\r\n" + remainder)
-            # Stream rest & store if 200 OK
-            if code == "200":
-                with open(body_f + ".tmp", "wb") as out:
-                    out.write(remainder)
-                    while True:
-                        chunk = origin.recv(BUFFER)
-                        if not chunk:
-                            break
-                        client.sendall(chunk)
-                        out.write(chunk)
-                os.replace(body_f + ".tmp", body_f)
-                # save meta
-                meta = {
-                    "etag": resp_headers.get("etag"),
-                    "last-modified": resp_headers.get("last-modified"),
-                    "saved": time.time(),
-                }
-                with open(meta_f, "w", encoding="utf-8") as mf:
-                    json.dump(meta, mf)
-            else:
-                while True:
-                    chunk = origin.recv(BUFFER)
-                    if not chunk:
-                        break
-                    client.sendall(chunk)
-            log(f"{method} {url} -> {code}")
-    except Exception:
+            self.writer.abort()
+            self.failed = True
+        finally:
+            on_finish(self)
+            async with self.progress:
+                self.progress.notify_all()
+            await body.aclose()
+
+
+class DownloadBody:
+    """Тело ответа для одного клиента, читаемое из временного файла идущей загрузки."""
+
+    def __init__(self, download: Download):
+        self.download = download
+        # Открываем сразу: после commit() временный файл переименуется, но открытый дескриптор останется
+        self.file = open(download.writer.tmp_path, "rb")
+        self.pos = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        download = self.download
+        if self.pos >= download.size and not download.done:
+            async with download.progress:
+                await download.progress.wait_for(
+                    lambda: self.pos < download.size or download.done or download.failed)
+        if self.pos < download.size:
+            data = self.file.read(min(BUFFER_SIZE, download.size - self.pos))
+            if not data:
+                raise ConnectionError("Cache file is shorter than the download")
+            self.pos += len(data)
+            return data
+        if download.failed:
+            raise ConnectionError("Origin download failed")
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        self.file.close()
+
+
+class CacheStage:
+    """Кэш GET-ответов на диске.
+
+    Свежая копия (см. freshness) отдаётся без обращения к серверу; устаревшая
+    перепроверяется через If-None-Match / If-Modified-Since, и ответ 304
+    продлевает её срок. Тела и метаданные хранит CacheStore.
+
+    На URL хранится одна копия. Если ответ пришёл с Vary, вместе с ним
+    запоминаются значения перечисленных заголовков запроса (meta["variant"]);
+    запрос с другими значениями (например, без Accept-Encoding: gzip) считается
+    промахом, и новый ответ заменяет копию.
+
+    Одновременные промахи по одному URL объединяются: первый запрос идёт к
+    серверу, остальные ждут его ответа и читают то же тело (Download).
+    """
+
+    def __init__(self, store: CacheStore | None = None):
+        self.store = store or CacheStore()
+        self.downloads = {}
+        self.shared = 0
+        self._tasks = set()
+
+    async def handle(self, ex, call_next) -> Response:
+        if ex.method.upper() != "GET":
+            return await call_next(ex)
+        hsh = url_hash(ex.url)
+        meta = self._matching_meta(ex, hsh)
+        response = self._fresh_response(ex, hsh, meta)
+        if response is not None:
+            return response
+
+        download = self.downloads.get(hsh)
+        if download is not None:
+            await download.head_ready.wait()
+            if download.streaming and variant(ex.headers, download.variant) == download.variant:
+                self.shared += 1
+                return Response(download.status_line, list(download.headers), DownloadBody(download),
+                                note="cache shared")
+            # Загрузка уже закончилась, ответ не кэшируется или другой вариант: проверяем кэш заново
+            # (промах этого запроса уже посчитан)
+            response = self._fresh_response(ex, hsh, self._matching_meta(ex, hsh, count_miss=False))
+            if response is not None:
+                return response
+            return await call_next(ex)
+
+        download = self.downloads[hsh] = Download(hsh)
         try:
-            client.sendall(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length:0\r\n\r\n")
-        except Exception:
-            pass
-    finally:
-        client.close()
+            return await self._fetch(ex, hsh, meta, download, call_next)
+        finally:
+            if not download.streaming and self.downloads.get(hsh) is download:
+                del self.downloads[hsh]
+            download.head_ready.set()
+
+    def _matching_meta(self, ex, hsh: str, count_miss: bool = True) -> dict | None:
+        """Метаданные копии, если она подходит запросу по Vary."""
+        meta = self.store.get_meta(hsh, count_miss)
+        if meta is None:
+            return None
+        stored = meta.get("variant") or {}
+        return meta if variant(ex.headers, stored) == stored else None
+
+    def _fresh_response(self, ex, hsh: str, meta: dict | None) -> Response | None:
+        if meta is None or meta.get("fresh_until", 0) <= time.time() or wants_revalidation(ex):
+            return None
+        body_cached = self.store.open_body(hsh)
+        if body_cached is None:
+            return None
+        return cached_response(body_cached, meta, "cache hit")
+
+    async def _fetch(self, ex, hsh: str, meta: dict | None, download: Download, call_next) -> Response:
+        client_validators = {name: ex.headers.get(name) for name in ("if-none-match", "if-modified-since")}
+        if meta is not None:
+            if meta.get("etag"):
+                ex.headers["if-none-match"] = meta["etag"]
+            if meta.get("last-modified"):
+                ex.headers["if-modified-since"] = meta["last-modified"]
+
+        request_time = time.time()
+        resp = await call_next(ex)
+        response_time = time.time()
+        if resp.code == "304" and meta is not None:
+            body_cached = self.store.open_body(hsh)
+            if body_cached is None:
+                # Тело пропало с диска, а 304 — ответ на валидаторы прокси, а не клиента:
+                # повторяем запрос с заголовками клиента
+                await resp.aclose()
+                for name, value in client_validators.items():
+                    if value is None:
+                        ex.headers.pop(name, None)
+                    else:
+                        ex.headers[name] = value
+                request_time = time.time()
+                resp = await call_next(ex)
+                response_time = time.time()
+                meta = None
+        if resp.code == "304" and meta is not None:
+            await resp.aclose()
+            # Заголовки 304 обновляют сохранённые и задают новый срок свежести
+            headers = {k: v for k, v in meta.items() if k in STORED_HEADERS and v is not None}
+            headers.update((k.lower(), v) for k, v in resp.headers)
+            for name in STORED_HEADERS:
+                meta[name] = headers.get(name)
+            meta["created"] = created_at(headers, request_time, response_time)
+            meta["fresh_until"] = freshness(headers, meta["created"])
+            self.store.update_meta(hsh, meta)
+            return cached_response(body_cached, meta, "cache revalidated")
+
+        if resp.code != "200" or isinstance(resp.body, (bytes, bytearray)):
+            return resp
+        headers = {k.lower(): v for k, v in resp.headers}
+        if not storable(headers):
+            return resp
+        meta = {name: headers.get(name) for name in STORED_HEADERS}
+        meta["variant"] = variant(ex.headers, vary_names(headers))
+        meta["saved"] = response_time
+        meta["created"] = created_at(headers, request_time, response_time)
+        meta["fresh_until"] = freshness(headers, meta["created"])
+        download.status_line = resp.status_line
+        download.headers = resp.headers
+        download.variant = meta["variant"]
+        download.writer = self.store.open_writer(hsh, meta)
+        task = asyncio.get_running_loop().create_task(download.run(resp.body, self._finished))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return Response(resp.status_line, list(resp.headers), DownloadBody(download), note=resp.note)
+
+    def _finished(self, download: Download):
+        if self.downloads.get(download.key) is download:
+            del self.downloads[download.key]
+
 
 def main():
-    port = 8889
-    if len(sys.argv) > 1:
-        port = int(sys.argv[1])
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(("", port))
-    s.listen(100)
-    print(f"Proxy(cache) on {port}")
+    port = parse_port(8889, "usage: proxy_cache.py [port] [max_cache_mb]")
+    if port is None:
+        return
+    max_bytes = DISK_MAX_BYTES
+    if len(sys.argv) > 2:
+        try:
+            max_bytes = int(sys.argv[2]) * 1024 * 1024
+        except ValueError:
+            print("usage: proxy_cache.py [port] [max_cache_mb]")
+            return
+    store = CacheStore(max_bytes=max_bytes)
+    log = ProxyLog(LOG_FILE)
+    stage = CacheStage(store)
     try:
-        while True:
-            c,_ = s.accept()
-            threading.Thread(target=handle, args=(c,), daemon=True).start()
-    except KeyboardInterrupt:
-        pass
+        run_proxy([LoggingStage(log), stage], port, f"Proxy(cache) on {port}", log)
     finally:
-        s.close()
+        store.close()
+    print(f"Cache: {store.stats()}")
+    print(f"Shared downloads: {stage.shared}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
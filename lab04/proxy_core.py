@@ -0,0 +1,986 @@
+"""Общее ядро HTTP-прокси из lab04 на asyncio.
+
+Все соединения — неблокирующие сокеты, которые обслуживает один цикл событий
+через loop.sock_accept / sock_recv / sock_sendall / sock_connect, так что клиент
+не стоит отдельного потока. Обработка запроса — цепочка этапов (stages):
+у каждого есть метод
+
+    async def handle(self, ex: Exchange, call_next) -> Response
+
+который может ответить сам (чёрный список, кэш) или вызвать await call_next(ex)
+и обработать ответ следующих этапов. Последний шаг цепочки — запрос к серверу
+назначения, а для CONNECT — соединение, которое становится туннелем (tunnel.py).
+proxy.py, proxy_cache.py и proxy_blacklist.py отличаются только набором этапов.
+"""
+import asyncio
+import socket
+import sys
+import time
+from urllib.parse import urlsplit
+
+from dns_cache import DnsCache, interleave
+from tunnel import Tunnel
+
+BUFFER_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 64 * 1024
+CLIENT_TIMEOUT = 30
+CONNECT_TIMEOUT = 10
+ORIGIN_TIMEOUT = 30
+LOG_FLUSH_INTERVAL = 1.0
+ACCEPT_RETRY_DELAY = 0.1
+# Постоянные соединения с клиентами: сколько ждать следующего запроса и сколько запросов обслужить
+KEEPALIVE_TIMEOUT = 15
+KEEPALIVE_MAX_REQUESTS = 100
+
+# Через сколько секунд без ответа начинать соединение по следующему адресу сервера
+HAPPY_EYEBALLS_DELAY = 0.25
+
+POOL_MAX_IDLE_PER_HOST = 8
+POOL_MAX_PER_HOST = 64
+POOL_IDLE_TIMEOUT = 30.0
+POOL_SWEEP_INTERVAL = 5.0
+# Запросы, которые можно повторить в новом соединении, если соединение из пула оказалось мёртвым
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"}
+
+# Пометка в Via: запрос, который уже прошёл через этот прокси, вернулся к нему по кругу
+VIA = "1.1 lab04-proxy"
+
+# Разметку тела (Transfer-Encoding) прокси выбирает сам для каждого соединения
+HOP_BY_HOP = {"connection", "proxy-connection", "keep-alive", "te", "trailer", "transfer-encoding", "upgrade"}
+
+
+class ProxyError(Exception):
+    """Запрос нельзя обработать; status уходит клиенту."""
+
+    def __init__(self, status: str, message: str = ""):
+        super().__init__(message or status)
+        self.status = status
+
+
+class RequestBodyError(ProxyError):
+    """Тело запроса не удалось дочитать у клиента (ошибка разметки, таймаут, обрыв)."""
+
+
+class SocketReader:
+    """Буферизованное чтение из неблокирующего сокета через loop.sock_recv."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, sock: socket.socket):
+        self.loop = loop
+        self.sock = sock
+        self.buffer = bytearray()
+
+    async def read_head(self, limit: int = MAX_HEADER_SIZE) -> bytes | None:
+        """Возвращает заголовок без завершающей пустой строки; None — соединение закрыто до него."""
+        scanned = 0
+        while True:
+            end = self.buffer.find(b"\r\n\r\n", max(0, scanned - 3))
+            if end >= 0:
+                head = bytes(self.buffer[:end])
+                del self.buffer[:end + 4]
+                return head
+            if len(self.buffer) > limit:
+                raise ProxyError("431 Request Header Fields Too Large")
+            scanned = len(self.buffer)
+            data = await self.loop.sock_recv(self.sock, BUFFER_SIZE)
+            if not data:
+                return None
+            self.buffer += data
+
+    async def read_some(self, n: int) -> bytes:
+        """От 1 до n байт: сначала из буфера, иначе один recv."""
+        if not self.buffer:
+            data = await self.loop.sock_recv(self.sock, min(n, BUFFER_SIZE))
+            if not data:
+                raise ConnectionError("Connection closed in the middle of a message body")
+            self.buffer += data
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def read_line(self, limit: int = MAX_HEADER_SIZE) -> bytes:
+        """Строка до CRLF (без него)."""
+        while True:
+            line_end = self.buffer.find(b"\r\n")
+            if line_end >= 0:
+                line = bytes(self.buffer[:line_end])
+                del self.buffer[:line_end + 2]
+                return line
+            if len(self.buffer) > limit:
+                raise ProxyError("400 Bad Request")
+            data = await self.loop.sock_recv(self.sock, BUFFER_SIZE)
+            if not data:
+                raise ConnectionError("Connection closed in the middle of a chunked body")
+            self.buffer += data
+
+
+class RequestBody:
+    """Тело запроса клиента, которое читается из сокета по мере отправки серверу назначения.
+
+    length — Content-Length или None для chunked (куски отдаются уже декодированными,
+    трейлеры отбрасываются). Таймаут CLIENT_TIMEOUT действует на каждое чтение,
+    а не на всё тело, так что длинная загрузка не обрывается, пока данные идут.
+    Если клиент ждёт 100 Continue, оно отправляется перед первым чтением.
+    """
+
+    def __init__(self, reader: SocketReader, length: int | None, expect_continue: bool = False):
+        self.reader = reader
+        self.length = length
+        self.chunked = length is None
+        # Для chunked — сколько осталось в текущем куске
+        self.remaining = 0 if length is None else length
+        self.expect_continue = expect_continue
+        self.started = False
+        self.done = length == 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self.done:
+            raise StopAsyncIteration
+        if not self.started and self.expect_continue:
+            await self.reader.loop.sock_sendall(self.reader.sock, b"HTTP/1.1 100 Continue\r\n\r\n")
+        self.started = True
+        try:
+            data = await asyncio.wait_for(self._next(), CLIENT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RequestBodyError("408 Request Timeout")
+        except OSError:
+            raise RequestBodyError("400 Bad Request", "Client closed the connection in the middle of the body")
+        except RequestBodyError:
+            raise
+        except ProxyError as e:
+            raise RequestBodyError(e.status)
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+    async def _next(self) -> bytes:
+        reader = self.reader
+        if self.chunked and self.remaining == 0:
+            try:
+                size = int((await reader.read_line()).split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise RequestBodyError("400 Bad Request")
+            if size < 0:
+                raise RequestBodyError("400 Bad Request")
+            if size == 0:
+                while await reader.read_line():
+                    pass
+                self.done = True
+                return b""
+            self.remaining = size
+        data = await reader.read_some(self.remaining)
+        self.remaining -= len(data)
+        if self.remaining == 0:
+            if not self.chunked:
+                self.done = True
+            elif await reader.read_line():
+                raise RequestBodyError("400 Bad Request")
+        return data
+
+
+def parse_header_lines(lines: list[str]) -> list[tuple[str, str]]:
+    headers = []
+    for line in lines:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers.append((k.strip(), v.strip()))
+    return headers
+
+
+def header_name(key: str) -> str:
+    """Каноническое написание имени заголовка: user-agent -> User-Agent."""
+    return "-".join(part.capitalize() for part in key.split("-"))
+
+
+class Exchange:
+    """Один запрос клиента: разобранная стартовая строка, заголовки, тело и адрес назначения."""
+
+    def __init__(self, method: str, url: str, proto: str, headers: dict[str, str], body: bytes | RequestBody,
+                 client_address=None):
+        self.method = method
+        self.url = url
+        self.proto = proto
+        self.headers = headers
+        self.body = body
+        self.client_address = client_address
+        connection = f"{headers.get('connection', '')},{headers.get('proxy-connection', '')}".lower()
+        # Можно ли после ответа ждать от клиента следующий запрос в том же соединении
+        self.keep_alive = "close" not in connection and (proto == "HTTP/1.1" or "keep-alive" in connection)
+        p = urlsplit(url)
+        self.host = p.hostname
+        self.port = p.port or 80
+        self.path = p.path or "/"
+        if p.query:
+            self.path += f"?{p.query}"
+
+
+class Response:
+    """Ответ клиенту: статусная строка, заголовки и тело.
+
+    Тело — bytes, FileBody, Tunnel (ответ на CONNECT) или асинхронный итератор
+    кусков bytes с методом aclose() (например, OriginBody, читающий ответ сервера
+    назначения). note попадает в журнал.
+    """
+
+    def __init__(self, status_line: str, headers: list[tuple[str, str]], body=b"", note: str = ""):
+        self.status_line = status_line
+        self.headers = headers
+        self.body = body
+        self.note = note
+
+    @property
+    def code(self) -> str:
+        parts = self.status_line.split()
+        return parts[1] if len(parts) > 1 else "?"
+
+    def get(self, name: str, default=None):
+        name = name.lower()
+        for k, v in self.headers:
+            if k.lower() == name:
+                return v
+        return default
+
+    def set(self, name: str, value: str):
+        self.remove(name)
+        self.headers.append((name, value))
+
+    def remove(self, name: str):
+        name = name.lower()
+        self.headers = [(k, v) for k, v in self.headers if k.lower() != name]
+
+    def head_bytes(self) -> bytes:
+        lines = [self.status_line]
+        lines.extend(f"{k}: {v}" for k, v in self.headers)
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def aclose(self):
+        if not isinstance(self.body, (bytes, bytearray)):
+            await self.body.aclose()
+
+
+class FileBody:
+    """Тело ответа из открытого файла: отправляется через loop.sock_sendfile, не проходя через память."""
+
+    def __init__(self, file, size: int):
+        self.file = file
+        self.size = size
+
+    async def aclose(self):
+        self.file.close()
+
+
+def simple_response(status: str, html: str = "") -> Response:
+    body = html.encode()
+    headers = [("Content-Length", str(len(body)))]
+    if body:
+        headers.append(("Content-Type", "text/html"))
+    return Response(f"HTTP/1.1 {status}", headers, body)
+
+
+def body_framing(status: str, headers: list[tuple[str, str]], method: str) -> tuple[str, int]:
+    """Как определяется конец тела ответа: ("none" | "chunked" | "length" | "close", длина)."""
+    code = int(status) if status.isdigit() else 0
+    if method.upper() == "HEAD" or code in (204, 304) or 100 <= code < 200:
+        return "none", 0
+    lowered = {k.lower(): v for k, v in headers}
+    if "chunked" in lowered.get("transfer-encoding", "").lower():
+        return "chunked", 0
+    if "content-length" in lowered:
+        try:
+            length = int(lowered["content-length"])
+        except ValueError:
+            return "close", 0
+        if length >= 0:
+            return "length", length
+    return "close", 0
+
+
+def keeps_alive(proto: str, headers: list[tuple[str, str]]) -> bool:
+    """Оставит ли сервер соединение открытым после этого ответа (без учёта разметки тела)."""
+    connection = ",".join(v for k, v in headers if k.lower() == "connection").lower()
+    if "close" in connection:
+        return False
+    return proto == "HTTP/1.1" or "keep-alive" in connection
+
+
+class PooledConnection:
+    """Соединение с сервером назначения, которое после ответа может вернуться в пул."""
+    __slots__ = ("key", "sock", "idle_since", "requests")
+
+    def __init__(self, key: tuple[str, int], sock: socket.socket):
+        self.key = key
+        self.sock = sock
+        self.idle_since = 0.0
+        self.requests = 0
+
+
+class UpstreamPool:
+    """Пул постоянных соединений с серверами назначения по ключу (host, port).
+
+    На каждый ключ одновременно выдаётся не больше max_per_host соединений
+    (остальные запросы ждут), простаивают не больше max_idle_per_host. Соединение,
+    простоявшее дольше idle_timeout или закрытое сервером (проверка recv с MSG_PEEK
+    перед выдачей), выбрасывается и в счётчике evicted.
+    """
+
+    def __init__(self, max_idle_per_host: int = POOL_MAX_IDLE_PER_HOST, max_per_host: int = POOL_MAX_PER_HOST,
+                 idle_timeout: float = POOL_IDLE_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.opened = 0
+        self.reused = 0
+        self.evicted = 0
+        self._idle = {}
+        self._limits = {}
+        self._in_use = {}
+        self._waiting = {}
+
+    async def acquire(self, host: str, port: int) -> PooledConnection:
+        key = (host, port)
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = asyncio.Semaphore(self.max_per_host)
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            await limit.acquire()
+        finally:
+            self._waiting[key] -= 1
+        self._in_use[key] = self._in_use.get(key, 0) + 1
+        try:
+            idle = self._idle.get(key)
+            while idle:
+                conn = idle.pop()
+                if self._healthy(conn):
+                    self.reused += 1
+                    return conn
+                conn.sock.close()
+                self.evicted += 1
+            loop = asyncio.get_running_loop()
+            sock = await asyncio.wait_for(open_connection(loop, host, port), CONNECT_TIMEOUT)
+            self.opened += 1
+            return PooledConnection(key, sock)
+        except BaseException:
+            self._done(key)
+            raise
+
+    def release(self, conn: PooledConnection, reusable: bool):
+        """Возвращает соединение в пул или закрывает его; вызывается ровно один раз на acquire()."""
+        idle = self._idle.setdefault(conn.key, [])
+        # Сверх max_idle_per_host соединение оставляем, только если его уже ждут
+        if reusable and len(idle) < max(self.max_idle_per_host, self._waiting.get(conn.key, 0)):
+            conn.idle_since = time.monotonic()
+            idle.append(conn)
+        else:
+            conn.sock.close()
+        self._done(conn.key)
+
+    def _done(self, key: tuple[str, int]):
+        self._in_use[key] -= 1
+        self._limits[key].release()
+        if self._in_use[key] == 0 and not self._waiting.get(key) and not self._idle.get(key):
+            # Никто не держит и не ждёт соединений с этим сервером — забываем его
+            del self._in_use[key]
+            del self._limits[key]
+            self._idle.pop(key, None)
+            self._waiting.pop(key, None)
+
+    def _healthy(self, conn: PooledConnection) -> bool:
+        if time.monotonic() - conn.idle_since > self.idle_timeout:
+            return False
+        try:
+            conn.sock.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        # Пустой ответ — сервер закрыл соединение; данные без запроса — соединение испорчено
+        return False
+
+    def sweep(self):
+        """Закрывает соединения, простоявшие дольше idle_timeout."""
+        now = time.monotonic()
+        for key in list(self._idle):
+            idle = self._idle[key]
+            fresh = [conn for conn in idle if now - conn.idle_since <= self.idle_timeout]
+            for conn in idle:
+                if now - conn.idle_since > self.idle_timeout:
+                    conn.sock.close()
+                    self.evicted += 1
+            self._idle[key] = fresh
+            if not fresh and not self._in_use.get(key) and not self._waiting.get(key):
+                del self._idle[key]
+                self._limits.pop(key, None)
+                self._in_use.pop(key, None)
+                self._waiting.pop(key, None)
+
+    async def run_sweeper(self):
+        while True:
+            await asyncio.sleep(POOL_SWEEP_INTERVAL)
+            self.sweep()
+
+    def stats(self) -> dict:
+        return {
+            "hosts": len(self._limits),
+            "idle": sum(len(idle) for idle in self._idle.values()),
+            "in_use": sum(self._in_use.values()),
+            "opened": self.opened,
+            "reused": self.reused,
+            "evicted": self.evicted,
+        }
+
+
+UPSTREAM_POOL = UpstreamPool()
+RESOLVER = DnsCache()
+
+
+class OriginBody:
+    """Тело ответа сервера назначения, отдаваемое кусками данных без разметки.
+
+    Граница тела определяется разметкой (Content-Length, chunked или закрытие
+    соединения), поэтому, дочитав тело, соединение можно вернуть в UPSTREAM_POOL.
+    Chunked-тело декодируется, трейлеры отбрасываются; как передать тело клиенту,
+    решает ProxyServer.send_response. Если тело не дочитано (клиент ушёл),
+    соединение закрывается.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, conn: PooledConnection, buffer: bytearray,
+                 framing: str, length: int, reusable: bool):
+        self.loop = loop
+        self.conn = conn
+        self.buffer = buffer
+        self.framing = framing
+        self.remaining = length
+        self.reusable = reusable and framing != "close"
+        self._chunk_state = "size"
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self.conn is None:
+            raise StopAsyncIteration
+        if self.framing == "length":
+            if self.remaining == 0:
+                self._finish(self.reusable)
+                raise StopAsyncIteration
+            if not self.buffer:
+                await self._fill()
+            data = self._take(min(self.remaining, len(self.buffer)))
+            self.remaining -= len(data)
+            return data
+        if self.framing == "chunked":
+            data = await self._next_chunk()
+            if data is None:
+                self._finish(self.reusable)
+                raise StopAsyncIteration
+            return data
+        if self.framing == "close":
+            if not self.buffer:
+                data = await asyncio.wait_for(self.loop.sock_recv(self.conn.sock, BUFFER_SIZE), ORIGIN_TIMEOUT)
+                if not data:
+                    self._finish(False)
+                    raise StopAsyncIteration
+                return data
+            return self._take(len(self.buffer))
+        self._finish(self.reusable)
+        raise StopAsyncIteration
+
+    async def _next_chunk(self) -> bytes | None:
+        """Очередной кусок данных chunked-тела; None — тело (вместе с трейлерами) кончилось."""
+        while True:
+            if self._chunk_state == "data":
+                if not self.buffer:
+                    await self._fill()
+                data = self._take(min(self.remaining, len(self.buffer)))
+                self.remaining -= len(data)
+                if self.remaining == 0:
+                    self._chunk_state = "data-end"
+                return data
+            if self._chunk_state == "done":
+                return None
+            line = await self._read_line()
+            if self._chunk_state == "data-end":
+                if line:
+                    raise ConnectionError("Missing CRLF after chunk data from origin")
+                self._chunk_state = "size"
+            elif self._chunk_state == "size":
+                try:
+                    size = int(line.split(b";", 1)[0].strip(), 16)
+                except ValueError:
+                    raise ConnectionError("Invalid chunk size from origin")
+                if size < 0:
+                    raise ConnectionError("Invalid chunk size from origin")
+                self._chunk_state = "data" if size else "trailer"
+                self.remaining = size
+            elif not line:
+                # Пустая строка после трейлеров завершает тело
+                self._chunk_state = "done"
+
+    async def _read_line(self) -> bytes:
+        while True:
+            line_end = self.buffer.find(b"\r\n")
+            if line_end >= 0:
+                return self._take(line_end + 2)[:-2]
+            if len(self.buffer) > MAX_HEADER_SIZE:
+                raise ConnectionError("Chunk header too long")
+            await self._fill()
+
+    async def _fill(self):
+        data = await asyncio.wait_for(self.loop.sock_recv(self.conn.sock, BUFFER_SIZE), ORIGIN_TIMEOUT)
+        if not data:
+            self._finish(False)
+            raise ConnectionError("Origin closed the connection in the middle of the body")
+        self.buffer += data
+
+    def _take(self, n: int) -> bytes:
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    def finish(self):
+        """Тела нет (HEAD, 204, 304): соединение сразу возвращается в пул."""
+        self._finish(self.reusable)
+
+    def _finish(self, reusable: bool):
+        if self.conn is not None:
+            # Лишние байты после тела означают, что разметка не сошлась — такое соединение не переиспользуем
+            UPSTREAM_POOL.release(self.conn, reusable and not self.buffer)
+            self.conn = None
+
+    async def aclose(self):
+        self._finish(False)
+
+
+def rebuild_request(method: str, path: str, proto: str, headers: dict[str, str], body: bytes | RequestBody) -> bytes:
+    """Запрос к серверу назначения; тело-поток (RequestBody) сюда не входит, его отправляет send_body."""
+    lines = [f"{method} {path} {proto}"]
+    for k, v in headers.items():
+        if k in HOP_BY_HOP or k in ("via", "expect", "content-length"):
+            continue
+        lines.append(f"{header_name(k)}: {v}")
+    via = headers.get("via")
+    lines.append(f"Via: {via}, {VIA}" if via else f"Via: {VIA}")
+    if isinstance(body, RequestBody):
+        lines.append("Transfer-Encoding: chunked" if body.chunked else f"Content-Length: {body.length}")
+        body = b""
+    elif body or "content-length" in headers:
+        lines.append(f"Content-Length: {len(body)}")
+    lines.append("Connection: keep-alive")
+    return "\r\n".join(lines).encode() + b"\r\n\r\n" + body
+
+
+async def send_body(loop: asyncio.AbstractEventLoop, sock: socket.socket, body: RequestBody):
+    """Перекачивает тело запроса от клиента серверу; chunked-тело размечается заново."""
+    async for chunk in body:
+        if body.chunked:
+            chunk = b"%x\r\n%b\r\n" % (len(chunk), chunk)
+        await loop.sock_sendall(sock, chunk)
+    if body.chunked:
+        await loop.sock_sendall(sock, b"0\r\n\r\n")
+
+
+async def connect_address(loop: asyncio.AbstractEventLoop, info: tuple) -> socket.socket:
+    family, type_, proto, _, address = info
+    sock = socket.socket(family, type_, proto)
+    sock.setblocking(False)
+    try:
+        await loop.sock_connect(sock, address)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+async def open_connection(loop: asyncio.AbstractEventLoop, host: str, port: int) -> socket.socket:
+    """Неблокирующее соединение с сервером назначения по адресам из RESOLVER.
+
+    Адреса пробуются в духе happy eyeballs (RFC 8305): семейства чередуются, и
+    если очередная попытка не удалась или не закончилась за HAPPY_EYEBALLS_DELAY,
+    параллельно начинается следующая. Побеждает первое установленное соединение,
+    остальные закрываются.
+    """
+    infos = interleave(await RESOLVER.resolve(host, port))
+    attempts = set()
+    errors = []
+    next_info = 0
+    try:
+        while next_info < len(infos) or attempts:
+            timeout = None
+            if next_info < len(infos):
+                attempts.add(loop.create_task(connect_address(loop, infos[next_info])))
+                next_info += 1
+                timeout = HAPPY_EYEBALLS_DELAY
+            done, attempts = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            for attempt in done:
+                if attempt.exception() is not None:
+                    errors.append(attempt.exception())
+                elif winner is None:
+                    winner = attempt.result()
+                else:
+                    attempt.result().close()
+            if winner is not None:
+                return winner
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+    raise errors[0] if errors else OSError(f"No addresses for {host}")
+
+
+async def open_tunnel(ex: Exchange) -> Response:
+    """Последний шаг цепочки для CONNECT: соединение с сервером, которое станет туннелем."""
+    loop = asyncio.get_running_loop()
+    try:
+        sock = await asyncio.wait_for(open_connection(loop, ex.host, ex.port), CONNECT_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return simple_response("502 Bad Gateway")
+    return Response("HTTP/1.1 200 Connection Established", [], Tunnel(sock, f"{ex.host}:{ex.port}"), note="tunnel")
+
+
+async def fetch_from_origin(ex: Exchange) -> Response:
+    """Последний этап цепочки: отправляет запрос серверу назначения и возвращает его ответ потоком.
+
+    Соединение берётся из UPSTREAM_POOL. Если взятое из пула соединение
+    оказалось закрыто сервером до ответа, идемпотентный запрос повторяется в новом
+    (но не после того, как началась перекачка тела от клиента).
+    """
+    loop = asyncio.get_running_loop()
+    request = rebuild_request(ex.method, ex.path, ex.proto, ex.headers, ex.body)
+    streaming = isinstance(ex.body, RequestBody)
+    for attempt in range(2):
+        try:
+            conn = await asyncio.wait_for(UPSTREAM_POOL.acquire(ex.host, ex.port), ORIGIN_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            return simple_response("502 Bad Gateway")
+        reused = conn.requests > 0
+        reader = SocketReader(loop, conn.sock)
+        try:
+            await loop.sock_sendall(conn.sock, request)
+            if streaming:
+                await send_body(loop, conn.sock, ex.body)
+            head = await asyncio.wait_for(reader.read_head(), ORIGIN_TIMEOUT)
+            if head is None:
+                raise ConnectionError("Origin closed the connection before responding")
+        except RequestBodyError:
+            UPSTREAM_POOL.release(conn, False)
+            raise
+        except (OSError, ProxyError) as e:
+            UPSTREAM_POOL.release(conn, False)
+            if (reused and attempt == 0 and ex.method.upper() in IDEMPOTENT_METHODS and not reader.buffer
+                    and not (streaming and ex.body.started)):
+                continue
+            return simple_response("502 Bad Gateway")
+        except asyncio.TimeoutError:
+            UPSTREAM_POOL.release(conn, False)
+            return simple_response("504 Gateway Timeout")
+        except BaseException:
+            UPSTREAM_POOL.release(conn, False)
+            raise
+        break
+    conn.requests += 1
+
+    lines = head.decode("latin-1").split("\r\n")
+    status_line = lines[0]
+    parts = status_line.split(None, 2)
+    if len(parts) < 2:
+        UPSTREAM_POOL.release(conn, False)
+        return simple_response("502 Bad Gateway")
+    headers = parse_header_lines(lines[1:])
+    # Клиенту прокси отвечает от своего имени по HTTP/1.1, какой бы версии ни был сервер
+    status_line = " ".join(["HTTP/1.1"] + parts[1:])
+    framing, length = body_framing(parts[1], headers, ex.method)
+    body = OriginBody(loop, conn, reader.buffer, framing, length, keeps_alive(parts[0], headers))
+    # Content-Length остаётся, если он был; chunked-тело уходит клиенту уже декодированным, и
+    # Content-Length рядом с Transfer-Encoding отбрасывается (RFC 9112: разметку задаёт Transfer-Encoding)
+    client_headers = [(k, v) for k, v in headers if k.lower() not in HOP_BY_HOP
+                      and not (framing == "chunked" and k.lower() == "content-length")]
+    if framing == "none":
+        body.finish()
+        return Response(status_line, client_headers, b"")
+    return Response(status_line, client_headers, body)
+
+
+class ProxyLog:
+    """Журнал прокси: строки копятся в буфере файла и сбрасываются раз в секунду, не блокируя цикл событий."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._flush_scheduled = False
+
+    def write(self, entry: str):
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(f"[{ts}] {entry}\n")
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_later(LOG_FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        self._flush_scheduled = False
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LoggingStage:
+    """Пишет в журнал строку "METHOD url -> code" для каждого запроса."""
+
+    def __init__(self, log: ProxyLog):
+        self.log = log
+
+    async def handle(self, ex: Exchange, call_next) -> Response:
+        try:
+            resp = await call_next(ex)
+        except Exception as e:
+            code = e.status.split()[0] if isinstance(e, ProxyError) else "500"
+            self.log.write(f"{ex.method} {ex.url} -> {code} ({type(e).__name__})")
+            raise
+        note = f" ({resp.note})" if resp.note else ""
+        self.log.write(f"{ex.method} {ex.url} -> {resp.code}{note}")
+        if isinstance(resp.body, Tunnel):
+            resp.body.on_close.append(self._tunnel_closed)
+        return resp
+
+    def _tunnel_closed(self, tunnel: Tunnel):
+        reason = " (idle timeout)" if tunnel.idle_timeout else ""
+        self.log.write(f"CONNECT {tunnel.authority} closed: {tunnel.bytes_up} bytes up, "
+                       f"{tunnel.bytes_down} bytes down, {time.monotonic() - tunnel.started:.1f}s{reason}")
+
+
+class ProxyServer:
+    """Принимает соединения и прогоняет каждый запрос через цепочку этапов."""
+
+    def __init__(self, stages: list, port: int):
+        self.stages = stages
+        self.port = port
+        self.active = 0
+        self._tasks = set()
+
+    async def dispatch(self, ex: Exchange, index: int = 0) -> Response:
+        if index == len(self.stages):
+            if ex.method.upper() == "CONNECT":
+                return await open_tunnel(ex)
+            return await fetch_from_origin(ex)
+        return await self.stages[index].handle(ex, lambda e: self.dispatch(e, index + 1))
+
+    async def read_request(self, reader: SocketReader, client_address, timeout: float) -> Exchange | None:
+        head = await asyncio.wait_for(reader.read_head(), timeout)
+        if head is None:
+            return None
+        first, *rest = head.decode("latin-1").split("\r\n")
+        try:
+            method, url, proto = first.split()
+        except ValueError:
+            raise ProxyError("400 Bad Request")
+        if method.upper() == "CONNECT":
+            # Цель CONNECT — host:port; порт обязателен
+            try:
+                if urlsplit(f"//{url}").port is None:
+                    raise ValueError(url)
+            except ValueError:
+                raise ProxyError("400 Bad Request")
+            url = f"https://{url}"
+        hdrs = {k.lower(): v for k, v in parse_header_lines(rest)}
+        body = b""
+        expect_continue = proto == "HTTP/1.1" and hdrs.get("expect", "").lower() == "100-continue"
+        if "chunked" in hdrs.get("transfer-encoding", "").lower():
+            body = RequestBody(reader, None, expect_continue)
+        elif "content-length" in hdrs:
+            try:
+                length = int(hdrs["content-length"])
+            except ValueError:
+                raise ProxyError("400 Bad Request")
+            if length < 0:
+                raise ProxyError("400 Bad Request")
+            body = RequestBody(reader, length, expect_continue)
+            if length <= BUFFER_SIZE:
+                # Небольшое тело читаем сразу: такой запрос можно повторить в другом соединении
+                body = b"".join([chunk async for chunk in body])
+        if method.upper() != "CONNECT" and not url.startswith("http://") and "host" in hdrs:
+            url = f"http://{hdrs['host']}{url}"
+        try:
+            ex = Exchange(method, url, proto, hdrs, body, client_address)
+        except ValueError:
+            # Например, нечисловой порт в URL
+            raise ProxyError("400 Bad Request")
+        if not ex.host:
+            raise ProxyError("400 Bad Request")
+        if VIA in hdrs.get("via", ""):
+            raise ProxyError("508 Loop Detected")
+        return ex
+
+    async def send_response(self, loop, client: socket.socket, resp: Response, ex: Exchange | None) -> bool:
+        """Отправляет ответ, выбирая разметку тела для клиента; возвращает, остаётся ли соединение открытым.
+
+        Тело известной длины уходит с Content-Length, поток неизвестной длины —
+        chunked для HTTP/1.1 и до закрытия соединения для HTTP/1.0.
+        """
+        keep_alive = ex is not None and ex.keep_alive
+        code = resp.code
+        bodiless = ex is not None and ex.method.upper() == "HEAD" or code in ("204", "304") or code.startswith("1")
+        chunked = False
+        if isinstance(resp.body, (bytes, bytearray)):
+            if not bodiless and resp.get("content-length") is None:
+                resp.set("Content-Length", str(len(resp.body)))
+        elif not isinstance(resp.body, FileBody) and resp.get("content-length") is None:
+            if ex is not None and ex.proto == "HTTP/1.1":
+                resp.set("Transfer-Encoding", "chunked")
+                chunked = True
+            else:
+                keep_alive = False
+        resp.set("Connection", "keep-alive" if keep_alive else "close")
+
+        head = resp.head_bytes()
+        if isinstance(resp.body, (bytes, bytearray)):
+            await loop.sock_sendall(client, head + resp.body)
+        elif isinstance(resp.body, FileBody):
+            await send_file(loop, client, head, resp.body)
+        else:
+            await loop.sock_sendall(client, head)
+            async for chunk in resp.body:
+                if not chunk:
+                    continue
+                if chunked:
+                    chunk = b"%x\r\n%b\r\n" % (len(chunk), chunk)
+                await loop.sock_sendall(client, chunk)
+            if chunked:
+                await loop.sock_sendall(client, b"0\r\n\r\n")
+        return keep_alive
+
+    async def handle_client(self, client: socket.socket, client_address):
+        """Обслуживает соединение клиента: запросы по очереди, пока обе стороны держат его открытым."""
+        loop = asyncio.get_running_loop()
+        self.active += 1
+        reader = SocketReader(loop, client)
+        try:
+            for served in range(KEEPALIVE_MAX_REQUESTS):
+                resp = None
+                ex = None
+                try:
+                    try:
+                        ex = await self.read_request(reader, client_address,
+                                                     CLIENT_TIMEOUT if served == 0 else KEEPALIVE_TIMEOUT)
+                        if ex is None:
+                            return
+                        if served + 1 == KEEPALIVE_MAX_REQUESTS:
+                            ex.keep_alive = False
+                        resp = await self.dispatch(ex)
+                        if isinstance(ex.body, RequestBody) and not ex.body.done:
+                            # Ответ без чтения тела (блокировка, ошибка сервера): остаток тела не нужен,
+                            # и следующий запрос в этом соединении не найти
+                            ex.keep_alive = False
+                    except ProxyError as e:
+                        # После ошибки разбора непонятно, где начинается следующий запрос
+                        resp = simple_response(e.status)
+                        ex = None
+                    except (ConnectionError, asyncio.TimeoutError):
+                        return
+                    if isinstance(resp.body, Tunnel):
+                        await loop.sock_sendall(client, resp.head_bytes())
+                        initial = bytes(reader.buffer)
+                        reader.buffer.clear()
+                        await resp.body.relay(loop, client, initial)
+                        return
+                    keep_alive = await self.send_response(loop, client, resp, ex)
+                finally:
+                    if resp is not None:
+                        await resp.aclose()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            print(f"Error handling {client_address}: {type(e).__name__}: {e}")
+            try:
+                await loop.sock_sendall(client, b"HTTP/1.1 500 Internal Server Error\r\nContent-Length:0\r\n\r\n")
+            except OSError:
+                pass
+        finally:
+            client.close()
+            self.active -= 1
+
+    async def serve(self, banner: str):
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", self.port))
+        sock.listen(socket.SOMAXCONN)
+        sock.setblocking(False)
+        print(banner)
+        sweeper = loop.create_task(UPSTREAM_POOL.run_sweeper())
+        try:
+            while True:
+                try:
+                    client, client_address = await loop.sock_accept(sock)
+                except OSError as err:
+                    # Например, EMFILE: даём закрыться завершающимся соединениям и пробуем снова
+                    print(f"Accepting connection failed with error {err}")
+                    await asyncio.sleep(ACCEPT_RETRY_DELAY)
+                    continue
+                task = loop.create_task(self.handle_client(client, client_address))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            sweeper.cancel()
+            sock.close()
+
+
+async def send_file(loop, client: socket.socket, head: bytes, body: FileBody):
+    """Заголовок и тело из файла; с TCP_CORK заголовок уходит в одном сегменте с началом тела."""
+    cork = hasattr(socket, "TCP_CORK")
+    if cork:
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+    try:
+        await loop.sock_sendall(client, head)
+        await loop.sock_sendfile(client, body.file, 0, body.size)
+    finally:
+        if cork:
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+
+def raise_fd_limit():
+    """Поднимает мягкий лимит открытых файлов до жёсткого: каждому клиенту нужно два сокета."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def parse_port(default: int, usage: str) -> int | None:
+    if len(sys.argv) > 1:
+        try:
+            return int(sys.argv[1])
+        except ValueError:
+            print(usage)
+            return None
+    return default
+
+
+def run_proxy(stages: list, port: int, banner: str, log: ProxyLog | None = None):
+    """Запускает прокси с заданной цепочкой этапов до Ctrl+C."""
+    raise_fd_limit()
+    server = ProxyServer(stages, port)
+    try:
+        asyncio.run(server.serve(banner))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if log is not None:
+            log.close()
+    print(f"Upstream pool: {UPSTREAM_POOL.stats()}")
+    print(f"DNS: {RESOLVER.stats()}")
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+
+from blacklist_matcher import BlacklistFile, CompiledBlacklist, SubstringMatcher
+
+print("Running tests...")
+
+passed = 0
+
+# 1. Домен блокирует себя и поддомены, но не домены с тем же хвостом
+bl = CompiledBlacklist(["badexample.com", "x.co.uk"])
+print(f"Test 1 - Domains: {bl.domains.size} entries")
+assert bl.blocked("http://badexample.com/") and bl.blocked("http://www.BadExample.com/a")
+assert bl.blocked("http://a.x.co.uk:8080/")
+assert not bl.blocked("http://notbadexample.com/") and not bl.blocked("http://co.uk/")
+assert not bl.blocked("http://ok.com/?next=badexample.com")
+passed += 1
+
+# 2. Остальные записи ищутся в URL как подстроки
+bl = CompiledBlacklist(["/ads/", "utm_source=spam"])
+print(f"Test 2 - Substrings: {bl.substring_count} entries")
+assert bl.blocked("http://ok.com/ads/banner.png") and bl.blocked("http://ok.com/?utm_source=spam&x=1")
+assert not bl.blocked("http://ok.com/adsense/") and not bl.blocked("http://ok.com/")
+passed += 1
+
+# 3. Автомат находит подстроку, начинающуюся внутри частичного совпадения другой
+matcher = SubstringMatcher(["abcd", "bce", "c"])
+print("Test 3 - Overlapping patterns")
+assert matcher.contains("xxabce") and SubstringMatcher(["abcd", "bcx"]).contains("abcx")
+assert not SubstringMatcher(["abcd", "bcx"]).contains("abcbd")
+assert not SubstringMatcher([]).contains("anything")
+passed += 1
+
+# 4. Изменённый файл подхватывается без перезапуска (вне цикла событий — сразу)
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "blacklist.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# comment\nbadexample.com\n")
+    blacklist = BlacklistFile(path, check_interval=0)
+    assert blacklist.blocked("http://badexample.com/") and not blacklist.blocked("http://other.org/")
+    time.sleep(0.01)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("other.org\n")
+    print(f"Test 4 - Reload: other.org blocked={blacklist.blocked('http://other.org/')}")
+    assert blacklist.blocked("http://other.org/") and not blacklist.blocked("http://badexample.com/")
+    assert blacklist.reloads == 1
+passed += 1
+
+print(f"\nAll tests passed: {passed}")
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import tempfile
+
+from cache_store import CacheStore
+
+print("Running tests...")
+
+passed = 0
+
+
+def key(name):
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+def put(store, name, body, meta=None):
+    writer = store.open_writer(key(name), dict(meta or {}))
+    for i in range(0, len(body), 100):
+        writer.write(body[i:i + 100])
+    writer.commit()
+
+
+with tempfile.TemporaryDirectory() as directory:
+    # 1. Записанный объект читается, небольшой — из памяти; тело лежит в ab/cd/<hash>
+    store = CacheStore(directory, max_bytes=10_000, memory_bytes=2_000, memory_max_object=1_000, max_object=5_000)
+    put(store, "a", b"x" * 500, {"etag": '"1"'})
+    assert store.get_meta(key("a"))["etag"] == '"1"' and store.read_body(key("a")) == b"x" * 500
+    print(f"Test 1 - Small object served from memory: {store.stats()['memory_hits']} hit(s)")
+    assert store.memory_hits == 1 and store.disk_hits == 0
+    assert os.path.exists(os.path.join(directory, key("a")[:2], key("a")[2:4], key("a")))
+    passed += 1
+
+    # 2. Большой объект в память не попадает и читается с диска
+    put(store, "big", b"y" * 3_000)
+    assert store.read_body(key("big")) == b"y" * 3_000
+    print(f"Test 2 - Large object served from disk: {store.stats()['disk_hits']} hit(s)")
+    assert store.disk_hits == 1 and store.memory.stats()["entries"] == 1
+    passed += 1
+
+    # 3. Отменённая запись не оставляет ни объекта, ни временного файла
+    writer = store.open_writer(key("broken"), {})
+    writer.write(b"partial")
+    writer.abort()
+    print(f"Test 3 - Aborted write: meta={store.get_meta(key('broken'))}")
+    assert store.get_meta(key("broken")) is None
+    assert not os.listdir(store.tmp_dir)
+    passed += 1
+
+    # 4. LRU: при переполнении уходят объекты, к которым дольше всего не обращались
+    for name in ("b", "c", "d"):
+        put(store, name, b"z" * 2_000)
+    store.read_body(key("a"))
+    store.read_body(key("b"))
+    put(store, "e", b"w" * 2_000)
+    print(f"Test 4 - LRU eviction: {store.stats()['evictions']} evicted, {store.stats()['bytes']} bytes")
+    assert store.get_meta(key("big")) is None
+    assert all(store.get_meta(key(name)) is not None for name in ("a", "b", "c", "d", "e"))
+    assert store.stats()["bytes"] <= 9_000
+    passed += 1
+
+    # 5. После перезапуска индекс восстанавливает метаданные и счётчики обращений
+    store.close()
+    restarted = CacheStore(directory, max_bytes=10_000)
+    print(f"Test 5 - Restart: {restarted.stats()['entries']} entries, {restarted.stats()['bytes']} bytes")
+    assert restarted.stats()["bytes"] == store.stats()["bytes"] and restarted.read_body(key("e")) == b"w" * 2_000
+    assert restarted.get_meta(key("a"))["etag"] == '"1"' and restarted._entries[key("a")].hits == 2
+    restarted.close()
+    passed += 1
+
+with tempfile.TemporaryDirectory() as directory:
+    # 6. LFU: уходит объект с наименьшим числом обращений, даже если он самый свежий
+    store = CacheStore(directory, max_bytes=5_000, policy="lfu", max_object=2_500)
+    put(store, "hot", b"h" * 2_000)
+    put(store, "cold", b"c" * 2_000)
+    for _ in range(3):
+        store.read_body(key("hot"))
+    store.read_body(key("cold"))
+    put(store, "new", b"n" * 2_000)
+    hot, cold = store.get_meta(key("hot")) is not None, store.get_meta(key("cold")) is not None
+    print(f"Test 6 - LFU eviction: hot={hot}, cold={cold}")
+    assert hot and not cold
+    store.close()
+    passed += 1
+
+with tempfile.TemporaryDirectory() as directory:
+    # 7. Объект больше max_object не сохраняется и не вытесняет остальные; читатель получает тело целиком
+    store = CacheStore(directory, max_bytes=1_000)
+    put(store, "small", b"s" * 50)
+    writer = store.open_writer(key("huge"), {})
+    reader = open(writer.tmp_path, "rb")
+    for _ in range(50):
+        writer.write(b"h" * 100)
+    writer.commit()
+    streamed = reader.read()
+    reader.close()
+    print(f"Test 7 - Oversize object: {store.stats()['entries']} entries, {store.stats()['bytes']} bytes")
+    assert store.get_meta(key("huge")) is None and store.get_meta(key("small")) is not None
+    assert store.stats()["bytes"] == 50 and store.oversize == 1 and store.evictions == 0
+    assert streamed == b"h" * 5_000 and not os.listdir(store.tmp_dir)
+    store.close()
+    passed += 1
+
+print(f"\nAll tests passed: {passed}")
@@ -0,0 +1,84 @@
+import asyncio
+import socket
+import time
+
+from dns_cache import DnsCache, interleave
+
+print("Running tests...")
+
+passed = 0
+
+V4 = (socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", ("192.0.2.1", 0))
+V4_2 = (socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", ("192.0.2.2", 0))
+V6 = (socket.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", ("2001:db8::1", 0, 0, 0))
+
+
+def fake_lookup(host, port, family=0, type_=0):
+    """Вместо сети: example.test разрешается за 50 мс, остальные имена не существуют."""
+    time.sleep(0.05)
+    if host == "example.test":
+        return [V6, V4, V4, V4_2]
+    raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+
+
+async def scenario():
+    global passed
+    # 1. Одновременные запросы одного имени ждут один поиск, следующий берётся из кэша
+    dns = DnsCache(lookup=fake_lookup)
+    results = await asyncio.gather(*(dns.resolve("example.test", 80) for _ in range(10)))
+    again = await dns.resolve("Example.TEST", 8080)
+    print(f"Test 1 - Coalescing: {dns.stats()}")
+    assert dns.lookups == 1 and dns.coalesced == 9 and dns.hits == 1
+    assert all(r == results[0] for r in results) and len(results[0]) == 3
+    assert results[0][1][4] == ("192.0.2.1", 80) and results[0][0][4] == ("2001:db8::1", 80, 0, 0)
+    assert again[1][4] == ("192.0.2.1", 8080)
+    passed += 1
+
+    # 2. Ошибка разрешения запоминается на negative_ttl
+    dns = DnsCache(negative_ttl=0.2, lookup=fake_lookup)
+    for _ in range(2):
+        try:
+            await dns.resolve("missing.test", 80)
+            assert False, "gaierror expected"
+        except socket.gaierror:
+            pass
+    print(f"Test 2 - Negative cache: {dns.lookups} lookup(s), {dns.negative_hits} negative hit(s)")
+    assert dns.lookups == 1 and dns.negative_hits == 1
+    await asyncio.sleep(0.25)
+    try:
+        await dns.resolve("missing.test", 80)
+    except socket.gaierror:
+        pass
+    assert dns.lookups == 2
+    passed += 1
+
+    # 3. Запись устаревает через positive_ttl; IP-адреса не разрешаются вовсе
+    dns = DnsCache(positive_ttl=0.1, lookup=fake_lookup)
+    await dns.resolve("example.test", 80)
+    await asyncio.sleep(0.15)
+    await dns.resolve("example.test", 80)
+    literal = await dns.resolve("127.0.0.1", 80)
+    print(f"Test 3 - Expiry: {dns.lookups} lookups, literal={literal[0][4]}")
+    assert dns.lookups == 2 and literal[0][4] == ("127.0.0.1", 80)
+    passed += 1
+
+    # 4. Отмена одного из ждущих не прерывает поиск для остальных
+    dns = DnsCache(lookup=fake_lookup)
+    first = asyncio.ensure_future(dns.resolve("example.test", 80))
+    second = asyncio.ensure_future(dns.resolve("example.test", 80))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    print("Test 4 - Cancelled waiter")
+    assert len(await second) == 3 and dns.lookups == 1
+    passed += 1
+
+
+asyncio.run(scenario())
+
+# 5. Семейства адресов чередуются, порядок внутри семейства сохраняется
+order = [info[4][0] for info in interleave([V4, V4_2, V6])]
+print(f"Test 5 - Interleave: {order}")
+assert order == ["192.0.2.1", "2001:db8::1", "192.0.2.2"]
+passed += 1
+
+print(f"\nAll tests passed: {passed}")
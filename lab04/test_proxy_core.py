@@ -0,0 +1,121 @@
+import asyncio
+import socket
+
+from proxy_core import UPSTREAM_POOL, Exchange, ProxyServer, fetch_from_origin
+
+print("Running tests...")
+
+passed = 0
+
+# Готовые ответы сервера назначения; /close закрывает соединение, /dribble отдаётся по байту
+RESPONSES = {
+    "/chunked": b"HTTP/1.1 200 OK\r\nContent-Length: 999\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n",
+    "/length": b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello",
+    "/close": b"HTTP/1.0 200 OK\r\n\r\nuntil close",
+    "/dribble": b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                b"3;ext=1\r\nabc\r\nA\r\n0123456789\r\n0\r\nX-Trailer: 1\r\n\r\n",
+}
+
+
+async def origin(reader, writer):
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            path = head.split(b" ")[1].decode()
+            response = RESPONSES[path]
+            if path == "/dribble":
+                for i in range(len(response)):
+                    writer.write(response[i:i + 1])
+                    await writer.drain()
+                    await asyncio.sleep(0.001)
+            else:
+                writer.write(response)
+                await writer.drain()
+            if path == "/close":
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    writer.close()
+
+
+def dechunk(data: bytes) -> bytes:
+    body = b""
+    while True:
+        size_line, _, data = data.partition(b"\r\n")
+        size = int(size_line, 16)
+        if size == 0:
+            assert data == b"\r\n", data
+            return body
+        body, data = body + data[:size], data[size + 2:]
+
+
+async def through_proxy(port: int, path: str, proto: str = "HTTP/1.1"):
+    """Запрос через fetch_from_origin; ответ клиенту уходит через send_response в socketpair."""
+    loop = asyncio.get_running_loop()
+    ex = Exchange("GET", f"http://127.0.0.1:{port}{path}", proto, {"host": f"127.0.0.1:{port}"}, b"")
+    resp = await fetch_from_origin(ex)
+    proxy_side, client_side = socket.socketpair()
+    proxy_side.setblocking(False)
+    try:
+        keep_alive = await ProxyServer([], 0).send_response(loop, proxy_side, resp, ex)
+    finally:
+        await resp.aclose()
+        proxy_side.close()
+    data = b""
+    while chunk := client_side.recv(65536):
+        data += chunk
+    client_side.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    return keep_alive, head.decode("latin-1").split("\r\n"), body
+
+
+async def scenario():
+    global passed
+    server = await asyncio.start_server(origin, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    # 1. Transfer-Encoding важнее Content-Length: лишний Content-Length клиенту не уходит
+    keep_alive, head, body = await through_proxy(port, "/chunked")
+    print(f"Test 1 - Chunked with Content-Length: {head[1:]}")
+    assert not any(h.lower().startswith("content-length") for h in head)
+    assert "Transfer-Encoding: chunked" in head and keep_alive
+    assert dechunk(body) == b"hello world"
+    passed += 1
+
+    # 2. Тело по Content-Length отдаётся с той же длиной; соединение с сервером возвращается в пул
+    keep_alive, head, body = await through_proxy(port, "/length")
+    print(f"Test 2 - Content-Length body: {body!r}, pool {UPSTREAM_POOL.stats()}")
+    assert "Content-Length: 5" in head and body == b"hello" and keep_alive
+    assert UPSTREAM_POOL.stats()["opened"] == 1 and UPSTREAM_POOL.stats()["reused"] == 1
+    passed += 1
+
+    # 3. Тело до закрытия: клиенту HTTP/1.1 — chunked, клиенту HTTP/1.0 — тоже до закрытия
+    keep_alive, head, body = await through_proxy(port, "/close")
+    assert head[0] == "HTTP/1.1 200 OK" and "Transfer-Encoding: chunked" in head and keep_alive
+    assert dechunk(body) == b"until close"
+    keep_alive, head, body = await through_proxy(port, "/close", "HTTP/1.0")
+    print(f"Test 3 - Close-delimited body: keep_alive={keep_alive}, {head[1:]}")
+    assert "Connection: close" in head and body == b"until close" and not keep_alive
+    passed += 1
+
+    # 4. Chunked-тело по одному байту: расширения куска и трейлеры разбираются, соединение переиспользуется
+    reused = UPSTREAM_POOL.stats()["reused"]
+    keep_alive, head, body = await through_proxy(port, "/dribble")
+    print(f"Test 4 - Dribbled chunked body: {dechunk(body)!r}")
+    assert dechunk(body) == b"abc0123456789" and not any(h.startswith("X-Trailer") for h in head)
+    keep_alive, head, body = await through_proxy(port, "/length")
+    assert body == b"hello" and UPSTREAM_POOL.stats()["reused"] == reused + 1
+    passed += 1
+
+    # Закрываем простаивающие соединения пула, чтобы обработчики сервера завершились сами
+    UPSTREAM_POOL.idle_timeout = -1
+    UPSTREAM_POOL.sweep()
+    await asyncio.sleep(0.05)
+    server.close()
+    await server.wait_closed()
+
+
+asyncio.run(scenario())
+
+print(f"\nAll tests passed: {passed}")
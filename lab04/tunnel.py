@@ -0,0 +1,193 @@
+"""Туннели CONNECT для прокси из lab04.
+
+После ответа 200 Connection Established прокси перестаёт разбирать поток и
+пересылает байты в обе стороны, пока оба конца не закроют соединение или
+туннель не простоит TUNNEL_IDLE_TIMEOUT секунд без данных.
+
+На Linux каждое направление идёт через os.splice: сокет -> pipe -> сокет,
+данные не копируются в память процесса. Сокеты туннелю уже никто, кроме него,
+не читает, поэтому он сам следит за ними через loop.add_reader / add_writer:
+пока получатель не успевает принимать, чтение из источника приостанавливается
+и данные ждут в pipe. Там, где splice нет, данные копируются через один
+переиспользуемый буфер на направление (loop.sock_recv_into / sock_sendall).
+"""
+import asyncio
+import os
+import socket
+import sys
+import time
+
+TUNNEL_BUFFER_SIZE = 256 * 1024
+TUNNEL_IDLE_TIMEOUT = 300
+# Ёмкость pipe для splice; ядро может дать меньше (см. /proc/sys/fs/pipe-max-size)
+TUNNEL_PIPE_SIZE = 1024 * 1024
+USE_SPLICE = sys.platform.startswith("linux") and hasattr(os, "splice")
+
+
+class SpliceDirection:
+    """Одно направление туннеля через os.splice; finished завершается на EOF или ошибке."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, tunnel: "Tunnel", src: socket.socket,
+                 dst: socket.socket, upstream: bool):
+        self.loop = loop
+        self.tunnel = tunnel
+        self.src = src.fileno()
+        self.dst = dst.fileno()
+        self.dst_sock = dst
+        self.upstream = upstream
+        self.pipe_r, self.pipe_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        if hasattr(os, "F_SETPIPE_SZ"):
+            import fcntl
+            try:
+                fcntl.fcntl(self.pipe_w, fcntl.F_SETPIPE_SZ, TUNNEL_PIPE_SIZE)
+            except OSError:
+                pass
+        self.pending = 0
+        self.eof = False
+        self.writing = False
+        self.finished = loop.create_future()
+        loop.add_reader(self.src, self._on_readable)
+
+    def _on_readable(self):
+        try:
+            n = os.splice(self.src, self.pipe_w, TUNNEL_BUFFER_SIZE,
+                          flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(e)
+            return
+        if n == 0:
+            self.eof = True
+            self.loop.remove_reader(self.src)
+            if not self.pending:
+                self._shutdown()
+            return
+        self.pending += n
+        self.tunnel.count(self.upstream, n)
+        self._drain()
+
+    def _drain(self):
+        while self.pending:
+            try:
+                n = os.splice(self.pipe_r, self.dst, self.pending,
+                              flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            except BlockingIOError:
+                # Получатель не успевает: не читаем источник, пока pipe не опустеет
+                if not self.writing:
+                    self.loop.remove_reader(self.src)
+                    self.loop.add_writer(self.dst, self._drain)
+                    self.writing = True
+                return
+            except OSError as e:
+                self._fail(e)
+                return
+            self.pending -= n
+        if self.writing:
+            self.loop.remove_writer(self.dst)
+            self.writing = False
+            if not self.eof:
+                self.loop.add_reader(self.src, self._on_readable)
+        if self.eof:
+            self._shutdown()
+
+    def _shutdown(self):
+        try:
+            self.dst_sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+    def _fail(self, error: OSError):
+        if not self.finished.done():
+            self.finished.set_exception(error)
+
+    def close(self):
+        self.loop.remove_reader(self.src)
+        if self.writing:
+            self.loop.remove_writer(self.dst)
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
+
+
+class Tunnel:
+    """Тело ответа на CONNECT: соединение с сервером, по которому после заголовка идут сырые байты.
+
+    bytes_up — от клиента к серверу, bytes_down — обратно. Функции из on_close
+    вызываются с туннелем один раз, когда он закрыт.
+    """
+
+    def __init__(self, upstream: socket.socket, authority: str):
+        self.upstream = upstream
+        self.authority = authority
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.started = time.monotonic()
+        self.last_activity = self.started
+        self.idle_timeout = False
+        self.on_close = []
+        self._closed = False
+
+    def count(self, upstream: bool, n: int):
+        if upstream:
+            self.bytes_up += n
+        else:
+            self.bytes_down += n
+        self.last_activity = time.monotonic()
+
+    async def relay(self, loop: asyncio.AbstractEventLoop, client: socket.socket, initial: bytes = b""):
+        """Пересылает данные, пока туннель не закроется; initial — байты клиента, прочитанные вместе с CONNECT."""
+        if initial:
+            await loop.sock_sendall(self.upstream, initial)
+            self.count(True, len(initial))
+        if USE_SPLICE:
+            directions = [SpliceDirection(loop, self, client, self.upstream, True),
+                          SpliceDirection(loop, self, self.upstream, client, False)]
+            try:
+                await self._wait([d.finished for d in directions])
+            finally:
+                for d in directions:
+                    d.close()
+        else:
+            tasks = [loop.create_task(self._pump(loop, client, self.upstream, True)),
+                     loop.create_task(self._pump(loop, self.upstream, client, False))]
+            await self._wait(tasks)
+
+    async def _pump(self, loop, src: socket.socket, dst: socket.socket, upstream: bool):
+        buf = bytearray(TUNNEL_BUFFER_SIZE)
+        view = memoryview(buf)
+        while True:
+            n = await loop.sock_recv_into(src, buf)
+            if not n:
+                break
+            await loop.sock_sendall(dst, view[:n])
+            self.count(upstream, n)
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    async def _wait(self, waiters: list):
+        """Ждёт оба направления; ошибка в одном или простой дольше TUNNEL_IDLE_TIMEOUT закрывает туннель."""
+        pending = set(waiters)
+        try:
+            while pending:
+                timeout = self.last_activity + TUNNEL_IDLE_TIMEOUT - time.monotonic()
+                if timeout <= 0:
+                    self.idle_timeout = True
+                    return
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_EXCEPTION)
+                if any(not w.cancelled() and w.exception() is not None for w in done):
+                    return
+        finally:
+            for w in pending:
+                w.cancel()
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.upstream.close()
+        for callback in self.on_close:
+            callback(self)